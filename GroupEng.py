@@ -24,9 +24,9 @@ use by the rest of GroupEng
 .. moduleauthor:: Thomas G. Dimiduk tgd8@cornell.edu
 """
 
-import sys
 import os.path
 import os
+import argparse
 from GroupEng import controller
 import logging
 
@@ -36,19 +36,58 @@ fh = logging.FileHandler('GroupEng.log', mode='w')
 fh.setLevel(logging.DEBUG)
 log.addHandler(fh)
 
-if len(sys.argv) > 1:
+parser = argparse.ArgumentParser(description='Make groups of students')
+parser.add_argument('deck', nargs='?',
+                    help='input deck (.groupeng file), prompt for one if omitted')
+parser.add_argument('--stats', action='store_true',
+                    help='also write solver statistics (counts and times of '
+                    'rule checks, swaps and retries) as json')
+parser.add_argument('--restarts', type=int, default=None,
+                    help='number of independent restarts to run in parallel, '
+                    'keeping the best grouping (overrides restarts in the deck)')
+parser.add_argument('--serve', type=int, metavar='PORT',
+                    help='run as a grouping service on this port instead (see '
+                    'GroupEng/server.py)')
+parser.add_argument('--batch', nargs='+', metavar='PATH',
+                    help='run many input decks (files, directories of .groupeng '
+                    'files or glob patterns) in parallel and write a summary')
+parser.add_argument('--workers', type=int, default=None,
+                    help='number of worker processes for --serve or --batch')
+args = parser.parse_args()
+
+if args.batch is not None:
+    from GroupEng import batch
+    results, summary = batch.run_batch(args.batch, args.workers, args.restarts,
+                                       args.stats)
+    for r in results:
+        print('{0}: {1} ({2:.2f}s){3}'.format(
+            r.deck, r.status, r.seconds, ' ' + r.error if r.error else ''))
+    n = batch.counts(results)
+    print('{0} decks: {1} met all rules, {2} did not, {3} errors. Summary in '
+          '{4}'.format(len(results), n['met all rules'], n['rules not met'],
+                       n['error'], summary))
+elif args.serve is not None:
+    from GroupEng import server
+    print('Serving GroupEng on http://127.0.0.1:{0}/'.format(args.serve))
+    try:
+        server.serve(port=args.serve, workers=args.workers)
+    except KeyboardInterrupt:
+        pass
+elif args.deck is not None:
     log.debug('In command line version')
     try:
         debug = os.environ['DEBUG'].lower() == 'true'
     except KeyError:
         debug = False
     if debug:
-        status, outdir = controller.run(sys.argv[1])
+        status, outdir = controller.run(args.deck, args.restarts,
+                                            args.stats)
         if not status:
             print('Could not completely meet all rules')
     else:
         try:
-            status, outdir = controller.run(sys.argv[1])
+            status, outdir = controller.run(args.deck, args.restarts,
+                                            args.stats)
             if not status:
                 print('Could not completely meet all rules')
         except Exception as e:
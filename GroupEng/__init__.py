@@ -17,3 +17,6 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with GroupEng.  If not, see <http://www.gnu.org/licenses/>.
 from .controller import run
+from .controller import make_groups, Grouping
+from .input_parser import read_input
+from .student import load_classlist, students_from_table
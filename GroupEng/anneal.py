@@ -0,0 +1,186 @@
+# Copyright 2011, Thomas G. Dimiduk
+#
+# This file is part of GroupEng.
+#
+# GroupEng is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# GroupEng is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with GroupEng.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Simulated annealing solver.  Instead of fixing rules one at a time in
+priority order, minimize one weighted penalty over all of the rules by
+swapping pairs of students.
+
+.. moduleauthor:: Thomas G. Dimiduk tgd8@cornell.edu
+"""
+
+import logging
+import math
+import random
+
+from .group import swap
+from .rule import Aggregate
+
+log = logging.getLogger('log')
+
+def rule_weights(rules):
+    """
+    Weight for each rule in the penalty
+
+    Rules use the weight from the input deck if one was given, otherwise they
+    are weighted by priority: the first of n rules gets n, the last gets 1.
+    """
+    n = len(rules)
+    return dict((r, r.weight if r.weight is not None else n - i)
+                for i, r in enumerate(rules))
+
+def group_penalty(group, weights):
+    # only the rules the group has been asked to follow count
+    return sum(weights[r] * r.violation(group) for r in group.rules)
+
+def total_penalty(groups, weights):
+    return sum(group_penalty(g, weights) for g in groups)
+
+class Annealer(object):
+    """
+    Swap based simulated annealing over a set of groups
+
+    Only the two groups involved in a swap are rescored, so each step costs
+    about the same regardless of class size.
+    """
+    def __init__(self, rules, groups, students, rng=random):
+        self.rng = rng
+        self.rules = rules
+        self.weights = rule_weights(rules)
+        self.groups = groups
+        self.students = students
+        self.penalty = dict((g, group_penalty(g, self.weights))
+                            for g in groups)
+        self.cost = sum(self.penalty.values())
+
+    def propose(self):
+        """
+        Pick two students in different groups
+        """
+        while True:
+            s1 = self.rng.choice(self.students)
+            s2 = self.rng.choice(self.students)
+            if s1.group is not s2.group:
+                return s1, s2
+
+    def try_swap(self, s1, s2):
+        """
+        Swap s1 and s2, returning the change in cost and the new penalties of
+        their (original) groups
+        """
+        g1 = s1.group
+        g2 = s2.group
+        swap(s1, s2)
+        p1 = group_penalty(g1, self.weights)
+        p2 = group_penalty(g2, self.weights)
+        return p1 + p2 - self.penalty[g1] - self.penalty[g2], p1, p2
+
+    def accept(self, s1, s2, delta, p1, p2):
+        # s1 and s2 have already been swapped by try_swap
+        self.penalty[s2.group] = p1
+        self.penalty[s1.group] = p2
+        self.cost += delta
+
+    def initial_temperature(self, samples=100):
+        # start hot enough that a typical uphill move is often accepted
+        total = 0
+        for i in range(samples):
+            s1, s2 = self.propose()
+            delta, p1, p2 = self.try_swap(s1, s2)
+            swap(s1, s2)
+            total += abs(delta)
+        if total == 0:
+            return 1.0
+        return total / samples
+
+    def snapshot(self):
+        return [list(g.students) for g in self.groups]
+
+    def restore(self, snapshot):
+        for g, students in zip(self.groups, snapshot):
+            g.students = students
+            for s in students:
+                s.group = g
+        self.penalty = dict((g, group_penalty(g, self.weights))
+                            for g in self.groups)
+        self.cost = sum(self.penalty.values())
+
+    def run(self, steps, t_start=None, t_end=0.01):
+        if t_start is None:
+            t_start = self.initial_temperature()
+        t_end = min(t_end, t_start)
+        best_cost = self.cost
+        best = self.snapshot()
+        taken = 0
+        for step in range(steps):
+            if self.cost == 0:
+                break
+            taken += 1
+            t = t_start * (t_end / t_start) ** (step / steps)
+            s1, s2 = self.propose()
+            delta, p1, p2 = self.try_swap(s1, s2)
+            if delta <= 0 or self.rng.random() < math.exp(-delta / t):
+                self.accept(s1, s2, delta, p1, p2)
+                if self.cost < best_cost:
+                    best_cost = self.cost
+                    best = self.snapshot()
+            else:
+                # put them back
+                swap(s1, s2)
+        if best_cost < self.cost:
+            self.restore(best)
+        log.debug('Annealed for {} steps, final penalty {}'.format(
+            taken, self.cost))
+        return self.cost
+
+def anneal(rules, groups, students, steps=None, rng=random):
+    """
+    Minimize the weighted rule penalty of groups by simulated annealing
+
+    Parameters
+    ----------
+    rules: list<Rule>
+        Rules, in priority order
+    groups: list<Group>
+        Groups to improve, modified in place
+    students: list<Student>
+        Everyone in groups
+    steps: int (optional)
+        Number of swaps to try, defaults to 100 per student
+    rng: random.Random (optional)
+        Source of random choices, defaults to the random module
+
+    Returns
+    -------
+    success: bool
+        True if every group satisfies every rule
+    """
+    for r in rules:
+        if isinstance(r, Aggregate):
+            # as in apply_rule, aggregate picks which groups it packs and
+            # only those groups are held to it
+            r.apply(groups, students, rng)
+        else:
+            for g in groups:
+                g.add_rule(r)
+    if len(groups) < 2:
+        # with one group there is nothing to swap between
+        return all(g.happy for g in groups)
+    if steps is None:
+        steps = 100 * len(students)
+    Annealer(rules, groups, students, rng).run(steps)
+    return all(g.happy for g in groups)
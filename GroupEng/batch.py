@@ -0,0 +1,215 @@
+# Copyright 2011, Thomas G. Dimiduk
+#
+# This file is part of GroupEng.
+#
+# GroupEng is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# GroupEng is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with GroupEng.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Run many input decks at once.  Each class list is read into students once no
+matter how many decks use it (through its cache if any of them ask for
+cache_classlist), and the decks are run in parallel worker processes that are
+each handed the students once.  Each deck's output goes in a directory next to
+the deck, and a summary of the whole batch is written to a csv file.
+
+.. moduleauthor:: Thomas G. Dimiduk tgd8@cornell.edu
+"""
+
+import csv
+import glob
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from . import input_parser
+from .controller import find_files, group_deck, output_for, read_students
+
+log = logging.getLogger('log')
+
+def find_decks(paths):
+    """
+    Input decks named by a list of files, directories (meaning every .groupeng
+    file in them) and glob patterns, in order and without repeats
+    """
+    decks = []
+    for path in paths:
+        if os.path.isdir(path):
+            found = sorted(glob.glob(os.path.join(path, '*.groupeng')))
+        else:
+            found = sorted(glob.glob(path))
+        for deck in found:
+            if deck not in decks:
+                decks.append(deck)
+    return decks
+
+class Result(object):
+    """
+    How one deck in a batch went
+    """
+    def __init__(self, deck, status, seconds=0, n_groups=0, failures=0,
+                 output='', error=''):
+        self.deck = deck
+        # 'met all rules', 'rules not met' or 'error'
+        self.status = status
+        self.seconds = seconds
+        self.n_groups = n_groups
+        # number of (rule, group) pairs where the group breaks the rule
+        self.failures = failures
+        self.output = output
+        self.error = error
+
+fields = ['deck', 'status', 'seconds', 'n_groups', 'failures', 'output',
+          'error']
+
+# class lists shared with this worker process, see share_classlists
+_classlists = {}
+
+def share_classlists(classlists):
+    _classlists.update(classlists)
+
+def run_shared_deck(deck, dek, outdir, key, restart_override=None,
+                    write_stats=False):
+    """
+    run_deck for a class list handed to this worker by share_classlists
+    """
+    return run_deck(deck, dek, outdir, _classlists[key], restart_override,
+                    write_stats)
+
+def run_deck(deck, dek, outdir, students, restart_override=None,
+             write_stats=False):
+    """
+    Group one deck of a batch from an already read class list
+
+    Parameters
+    ----------
+    deck: string
+        Input deck file name
+    dek: dict
+        The parsed input deck
+    outdir: string
+        Directory to write output in
+    students: list<Student>
+        The class list, which may be shared with other decks (make_groups
+        leaves it alone)
+    """
+    start = time.perf_counter()
+    if isinstance(students, Exception):
+        # the class list could not be read
+        return Result(deck, 'error', error=str(students) or
+                      students.__class__.__name__)
+    try:
+        # the batch is already spread over the cpus
+        grouping = group_deck(deck, dek, students, restart_override,
+                              parallel=False, collect_stats=write_stats)
+        out = output_for(deck, dek, outdir)
+        with out:
+            grouping.write(out, deck, dek['classlist'], write_stats)
+    except Exception as e:
+        return Result(deck, 'error', time.perf_counter() - start,
+                      error=str(e) or e.__class__.__name__)
+    failures = sum(len(groups) for groups in grouping.failures().values())
+    return Result(deck, 'met all rules' if grouping.suceeded else
+                  'rules not met', time.perf_counter() - start,
+                  len(grouping.groups), failures, out.path)
+
+def run_batch(paths, workers=None, restart_override=None, write_stats=False,
+              summary=None):
+    """
+    Run every input deck named by paths
+
+    Parameters
+    ----------
+    paths: list<string>
+        Input decks, directories of input decks or glob patterns
+    workers: int (optional)
+        Number of worker processes, defaults to the number of cpus
+    restart_override: int (optional)
+        Number of restarts for every deck, overrides restarts in the decks
+    write_stats: bool
+        Also write solver statistics with each deck's output
+    summary: filename (optional)
+        Where to write the batch summary, defaults to
+        groupeng_batch_<date>_<time>.csv in the current directory
+
+    Returns
+    -------
+    results: list<Result>
+        One for each deck, in the order found
+    summary: filename
+    """
+    decks = find_decks(paths)
+    log.debug('Running a batch of {} decks'.format(len(decks)))
+    start = time.perf_counter()
+    results = [None] * len(decks)
+    jobs = []
+    # decks sharing a class list (and student identifier) share its students
+    decks_for = {}
+    for i, deck in enumerate(decks):
+        try:
+            dek = input_parser.read_input(deck)
+            classlist = find_files(deck, dek)[0]
+            # keep each deck's output next to the deck so decks with the same
+            # name do not collide
+            outdir = os.path.dirname(deck)
+            key = (os.path.abspath(classlist), dek.get('student_identifier'))
+            decks_for.setdefault(key, []).append(dek)
+            jobs.append((i, (deck, dek, outdir, key, restart_override,
+                             write_stats)))
+        except Exception as e:
+            results[i] = Result(deck, 'error', error=str(e) or
+                                e.__class__.__name__)
+
+    classlists = {}
+    for key, deks in decks_for.items():
+        dek = dict(deks[0], cache_classlist=any(d.get('cache_classlist')
+                                                for d in deks))
+        try:
+            classlists[key] = read_students(dek, key[0], all_columns=True)
+        except Exception as e:
+            # reported by each deck that uses it
+            classlists[key] = e
+    log.debug('Read {} class lists'.format(len(classlists)))
+
+    with ProcessPoolExecutor(workers, initializer=share_classlists,
+                             initargs=(classlists,)) as pool:
+        futures = [(i, pool.submit(run_shared_deck, *args))
+                   for i, args in jobs]
+        for i, future in futures:
+            results[i] = future.result()
+    total = time.perf_counter() - start
+
+    if summary is None:
+        summary = 'groupeng_batch_{0}.csv'.format(
+            time.strftime('%Y-%m-%d_%H-%M-%S'))
+    with open(summary, 'w', newline='') as outf:
+        write_summary(results, total, outf)
+    return results, summary
+
+def counts(results):
+    return dict((status, sum(1 for r in results if r.status == status))
+                for status in ['met all rules', 'rules not met', 'error'])
+
+def write_summary(results, total, outf):
+    writer = csv.writer(outf)
+    writer.writerow(fields)
+    for r in results:
+        row = [getattr(r, f) for f in fields]
+        row[fields.index('seconds')] = '{0:.3f}'.format(r.seconds)
+        writer.writerow(row)
+    writer.writerow([])
+    n = counts(results)
+    writer.writerow(['total', '{0} decks'.format(len(results)),
+                     '{0:.3f}'.format(total)])
+    for status in ['met all rules', 'rules not met', 'error']:
+        writer.writerow([status, n[status]])
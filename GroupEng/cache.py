@@ -0,0 +1,194 @@
+# Copyright 2011, Thomas G. Dimiduk
+#
+# This file is part of GroupEng.
+#
+# GroupEng is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# GroupEng is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with GroupEng.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Binary cache of parsed class lists, so reruns of the same class list skip csv
+parsing and type conversion.
+
+The cache file stores each column dictionary encoded: a small table of the
+column's distinct values (both as read and converted) and an array of one
+code per student.  The tables go in a json header and the code arrays are
+read straight out of a memory mapped file.  A cache is used if the class list's path, size and modification time
+match, or failing that if the content hash matches.
+
+.. moduleauthor:: Thomas G. Dimiduk tgd8@cornell.edu
+"""
+
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+from array import array
+
+from .student import (Schema, Student, column_converter, load_classlist,
+                      read_rows)
+
+log = logging.getLogger('log')
+
+magic = b'GroupEngCache2\n'
+# unsigned 32 bit codes
+code_type = 'I' if array('I').itemsize == 4 else 'L'
+header_length = struct.Struct('<Q')
+
+class StaleCache(Exception):
+    pass
+
+def cache_filename(filename):
+    head, tail = os.path.split(os.path.abspath(filename))
+    return os.path.join(head, '.{0}.groupeng-cache'.format(tail))
+
+def file_hash(filename):
+    h = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def file_key(filename):
+    st = os.stat(filename)
+    return {'path': os.path.abspath(filename), 'size': st.st_size,
+            'mtime': st.st_mtime_ns}
+
+def write_cache(filename, cache_file=None):
+    """
+    Parse a csv class list and write its cache file
+    """
+    if cache_file is None:
+        cache_file = cache_filename(filename)
+    rows = read_rows(filename)
+    headers = next(rows)
+    codes = [{} for h in headers]
+    columns = [array(code_type) for h in headers]
+    for row in rows:
+        for cell, column_codes, column in zip(row, codes, columns):
+            try:
+                code = column_codes[cell]
+            except KeyError:
+                code = column_codes[cell] = len(column_codes)
+            column.append(code)
+
+    raw = [sorted(c, key=c.get) for c in codes]
+    convert = [column_converter() for h in headers]
+    typed = [[f(v) for v in values] for f, values in zip(convert, raw)]
+    key = file_key(filename)
+    key['hash'] = file_hash(filename)
+    header = json.dumps({'key': key, 'headers': headers,
+                         'n_students': len(columns[0]) if columns else 0,
+                         'raw': raw, 'typed': typed}).encode('utf-8')
+
+    # write to a temporary name and move into place so an interrupted write
+    # never leaves a corrupt cache behind
+    tmp = cache_file + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(magic)
+        f.write(header_length.pack(len(header)))
+        f.write(header)
+        # pad so the code arrays are aligned
+        f.write(b'\0' * (-f.tell() % 8))
+        for column in columns:
+            column.tofile(f)
+    os.replace(tmp, cache_file)
+    log.debug('wrote class list cache {}'.format(cache_file))
+    return cache_file
+
+def read_cache(filename, identifier, columns=None, cache_file=None):
+    """
+    Load students from the cache of a class list
+
+    Raises StaleCache if there is no usable cache for the file.
+    """
+    if cache_file is None:
+        cache_file = cache_filename(filename)
+    try:
+        f = open(cache_file, 'rb')
+    except OSError:
+        raise StaleCache()
+    try:
+        with f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            return _read_students(m, filename, identifier, columns)
+    except (ValueError, EOFError, struct.error) as e:
+        # empty (mmap refuses those), truncated or otherwise unreadable
+        log.debug('unreadable class list cache {}: {}'.format(cache_file, e))
+        raise StaleCache()
+
+def _read_students(m, filename, identifier, columns):
+    if m[:len(magic)] != magic:
+        raise StaleCache()
+    start = len(magic) + header_length.size
+    n_header, = header_length.unpack(m[len(magic):start])
+    header = json.loads(m[start:start + n_header].decode('utf-8'))
+
+    key = file_key(filename)
+    cached = header['key']
+    if any(cached[k] != key[k] for k in key):
+        # touched or moved, but maybe not changed
+        if cached['hash'] != file_hash(filename):
+            raise StaleCache()
+
+    headers = header['headers']
+    n = header['n_students']
+    offset = start + n_header
+    offset += -offset % 8
+    itemsize = array(code_type).itemsize
+    if len(m) < offset + len(headers) * n * itemsize:
+        raise StaleCache()
+    codes = []
+    view = memoryview(m)
+    try:
+        codes = [view[offset + i*n*itemsize:offset + (i+1)*n*itemsize].cast(
+            code_type) for i in range(len(headers))]
+        return build_students(header, codes, identifier, columns)
+    finally:
+        # views have to be released before the map can be closed
+        for c in codes:
+            c.release()
+        view.release()
+
+def build_students(header, codes, identifier, columns=None):
+    headers = header['headers']
+    schema = Schema(headers, identifier, columns)
+    loaded = [(header['typed'][i], codes[i]) for i, h in enumerate(headers)
+              if h in schema.index]
+    passthrough = [(header['raw'][i], codes[i]) for i, h in enumerate(headers)
+                   if h in schema.passthrough_index]
+    students = []
+    for row in range(header['n_students']):
+        values = [table[c[row]] for table, c in loaded]
+        extra = tuple(table[c[row]] for table, c in passthrough)
+        students.append(Student(schema=schema, values=values,
+                                passthrough=extra))
+    return students
+
+def load_classlist_cached(filename, identifier, columns=None, cache_file=None):
+    """
+    load_classlist, but going through a cache file that is (re)built as needed
+    """
+    try:
+        students = read_cache(filename, identifier, columns, cache_file)
+        log.debug('read class list from cache')
+        return students
+    except StaleCache:
+        pass
+    try:
+        write_cache(filename, cache_file)
+        return read_cache(filename, identifier, columns, cache_file)
+    except (OSError, StaleCache) as e:
+        # can't write a cache next to the class list, that is fine
+        log.debug('could not cache class list: {}'.format(e))
+        return load_classlist(filename, identifier, columns)
@@ -17,14 +17,27 @@
 
 import time
 import os
+import copy
 import csv
+import io
+import random
+import zipfile
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from operator import attrgetter
+from .construct import make_constructive_groups
 from .group import make_initial_groups
 from .utility import mean, std
+from .errors import EmptyMean
 from .rule import make_rule, apply_rules_list, Balance, Distribute
+from .anneal import anneal
+from .feasibility import analyze
+from .cache import load_classlist_cached
 from .student import load_classlist
 from .course import Course, SubCourse, sizer_from_dek
 from . import input_parser
+from . import matrix
+from . import instrument
 
 
 import logging
@@ -40,7 +53,74 @@ see if it helps:\n{0}".format(self.e)
 class UnevenGroups(Exception):
     pass
 
-def run(input_deck):
+class SolverNotImplemented(Exception):
+    def __init__(self, solver):
+        self.solver = solver
+    def __str__(self):
+        return "Sorry, we don't have a solver named: {0}\nthe choices are: \
+{1}".format(self.solver, ', '.join(sorted(solvers)))
+
+class EmptyClassList(Exception):
+    def __str__(self):
+        return "There are no students to group, the class list is empty"
+
+class InitialNotImplemented(Exception):
+    def __init__(self, initial):
+        self.initial = initial
+    def __str__(self):
+        return "Sorry, we don't have initial groups named: {0}\nthe choices \
+are: {1}".format(self.initial, ', '.join(sorted(initial_groups)))
+
+def greedy(rules, groups, students, options, rng):
+    # Apply rules one at a time in priority order, fixing each as we go
+    checker = None
+    if options.get('matrix'):
+        checker = matrix.StudentMatrix(students)
+    return apply_rules_list(rules, groups, students, tries=options['tries'],
+                            patience=options.get('patience'),
+                            time_limit=options.get('time_limit'), rng=rng,
+                            matrix=checker)
+
+def annealing(rules, groups, students, options, rng):
+    # retry options do not mean anything to the annealer
+    return anneal(rules, groups, students, rng=rng)
+
+solvers = {'greedy': greedy, 'anneal': annealing}
+
+def constructive(course, rules, balance_rules, group_number_offset, rng):
+    # deal students to meet the count rules from the start
+    return make_constructive_groups(course, rules, group_number_offset, rng)
+
+def stratified(course, rules, balance_rules, group_number_offset, rng):
+    # deal students at random, only stratified by the balance rules
+    return make_initial_groups(course, balance_rules, group_number_offset, rng)
+
+initial_groups = {'constructive': constructive, 'stratified': stratified}
+
+class RunResult(tuple):
+    """
+    What run returns: unpacks as (suceeded, outdir) and also carries the
+    grouping and its solver stats
+    """
+    def __new__(cls, suceeded, outdir, grouping):
+        self = super(RunResult, cls).__new__(cls, (suceeded, outdir))
+        self.grouping = grouping
+        return self
+
+    @property
+    def suceeded(self):
+        return self[0]
+
+    @property
+    def outdir(self):
+        return self[1]
+
+    @property
+    def stats(self):
+        return self.grouping.stats
+
+def run(input_deck, restart_override=None, write_stats=False,
+        collect_stats=False):
     """
     Run GroupEng as specified by input_deck
 
@@ -48,51 +128,181 @@ def run(input_deck):
     ----------
     input_deck: filename
         Input file specifying class information and grouping rules
+    restart_override: int (optional)
+        Number of independent restarts to try, overrides restarts in the input
+        deck
+    write_stats: bool
+        Also write the solver statistics as json with the other output
+    collect_stats: bool
+        Collect the solver statistics without writing them
+
+    Returns
+    -------
+    result: RunResult
+        Unpacks as suceeded, outdir: whether all rules were met and the
+        directory (or zip archive if the input deck asks for one) the output
+        was written to.  result.stats are the solver statistics (empty unless
+        write_stats or collect_stats) and result.grouping the groups.
 
     Output
     ------
     Output files determined by Input deck
     """
-    cwd = os.getcwd()
     dek = input_parser.read_input(input_deck)
     log.debug('read input deck')
-    try:
-        students = load_classlist(dek['classlist'], dek.get('student_identifier'))
-    except FileNotFoundError:
+    classlist, outdir = find_files(input_deck, dek)
+    students = read_students(dek, classlist)
+    grouping = group_deck(input_deck, dek, students, restart_override,
+                          collect_stats=write_stats or collect_stats)
+
+    out = output_for(input_deck, dek, outdir)
+    with out:
+        grouping.write(out, input_deck, dek['classlist'], write_stats)
+    log.debug("wrote output")
+
+    return RunResult(grouping.suceeded, out.path, grouping)
+
+def group_deck(input_deck, dek, students, restart_override=None,
+               parallel=True, collect_stats=False):
+    """
+    Group students for an input deck file, fitting them into an earlier
+    grouping if the deck names previous_groups (found next to the deck if it
+    is not a path from here), see make_groups and regroup.regroup
+    """
+    if dek.get('previous_groups'):
+        # imported here since regroup builds on this module
+        from .regroup import load_previous, regroup
+        previous = dek['previous_groups']
+        if not os.path.exists(previous):
+            previous = os.path.join(os.path.dirname(input_deck), previous)
+        identifier = students[0].identifier if students else None
+        return regroup(dek, students, load_previous(previous, identifier),
+                       collect_stats)
+    return make_groups(dek, students, restart_override, parallel,
+                       collect_stats)
+
+def find_files(input_deck, dek):
+    """
+    Where to read the class list from and where to put the output for an
+    input deck
+
+    A class list given relative to the input deck is found by joining paths
+    (rather than changing directory), and the output then goes next to the
+    input deck as well.
+
+    Returns
+    -------
+    classlist: string
+        Path to the class list
+    outdir: string
+        Directory to make the output in
+    """
+    classlist = dek['classlist']
+    outdir = ''
+    if not os.path.exists(classlist):
         # relative file structure
         head, tail = os.path.split(input_deck)
-        os.chdir(head)
-        students = load_classlist(dek['classlist'], dek.get('student_identifier'))
+        classlist = os.path.join(head, classlist)
+        outdir = head
+    return classlist, outdir
+
+def output_for(input_deck, dek, outdir=''):
+    """
+    Make the output directory (or archive) for a run of an input deck
+    """
+    run_name = os.path.splitext(input_deck)[0]
+    # get rid of relative path
+    run_name = os.path.split(run_name)[1]
+    path = os.path.join(outdir, 'groups_{0}_{1}'.format(
+        run_name, time.strftime('%Y-%m-%d_%H-%M-%S')))
+    # return the full output directory (or archive).
+    if dek.get('archive'):
+        return OutputArchive(os.path.abspath(path), run_name)
+    log.debug('Made output directory')
+    return OutputDirectory(os.path.abspath(path), run_name)
+
+def read_students(dek, classlist=None, all_columns=False):
+    """
+    Load the class list named in an input deck
+
+    Parameters
+    ----------
+    dek: dict
+        Parsed input deck
+    classlist: filename (optional)
+        Where to find the class list if not at the path in the deck
+    all_columns: bool
+        Convert every column, not just the ones the deck's rules use (for a
+        class list several decks share)
+    """
+    if classlist is None:
+        classlist = dek['classlist']
+    if dek.get('cache_classlist'):
+        load = load_classlist_cached
+    else:
+        load = load_classlist
+    # only the columns rules look at need converting
+    columns = None if all_columns else rule_columns(dek)
+    students = load(classlist, dek.get('student_identifier'), columns)
     log.debug('read class list')
+    return students
+
+def make_groups(dek, students, restart_override=None, parallel=True,
+                collect_stats=False):
+    """
+    Group students as specified by an input deck, without touching files
+
+    This does not read the class list named in the deck or write any output
+    (see Grouping.write), and does not change the working directory, so it is
+    safe to call from several threads at once.
+
+    Parameters
+    ----------
+    dek: dict
+        Parsed input deck, as from input_parser.read_input
+    students: list<Student>
+        Students to group, as from load_classlist or students_from_table
+    restart_override: int (optional)
+        Number of independent restarts to try, overrides restarts in the input
+        deck
+    parallel: bool
+        Run restarts (and aggregate subclasses) in separate processes
+    collect_stats: bool
+        Count and time the solver's work by rule (see Grouping.stats), which
+        slows it down a little
+
+    Returns
+    -------
+    grouping: Grouping
+    """
+    if not students:
+        raise EmptyClassList()
+    # grouping adds phantoms, reorders the list and sets each student's
+    # group, so work on copies and leave the caller's students alone
+    students = [s.copy() for s in students]
     identifier = students[0].identifier
     dek_rules = dek['rules']
-    tries = 5
-    if 'tries' in dek:
-        tries = dek['tries']
-    log.debug('Allowing {} tries to get rules to work'.format(tries))
+    options = solver_options(dek)
+    options['stats'] = collect_stats
+    log.debug('Allowing {} tries to get rules to work'.format(options['tries']))
+    if options.get('patience') is not None:
+        log.debug('Giving up on a rule after {} tries without '
+                  'improvement'.format(options['patience']))
+    if options.get('time_limit') is not None:
+        log.debug('Spending at most {} seconds on each rule'.format(
+            options['time_limit']))
+    log.debug('Using {} solver'.format(options['solver']))
+    if options['seed'] is not None:
+        log.debug('Using random seed {}'.format(options['seed']))
 
     log.debug("Using Rules: "+str(dek_rules))
 
-    # This adds support for a "Hard" aggregate. If your first rule is
-    # aggregate, we split the class on that attribute and treat each
-    # value as a separate class. This ensures that we meet the rule
-    # exactly (adding extra phantoms as necessary). This is useful for
-    # things like needing all of the students in groups to be in the
-    # same recitation section.
-
     sizer = sizer_from_dek(dek)
     log.debug(sizer)
 
-    if len(dek_rules) > 0 and dek_rules[0]['name'] == 'aggregate':
-        attribute = dek_rules[0]['attribute']
-        # Turn back into a list to make sure ordering is preserved when we use
-        # this in multiple places
-        split_values = list(set(s[attribute] for s in students))
-        subclasses = [[s for s in students if s[attribute] == value]
-                      for value in split_values]
+    subclasses, dek_rules = split_class(students, dek_rules)
+    if subclasses is not None:
         subcourses = [SubCourse(sc, students, sizer) for sc in subclasses]
-
-        dek_rules = dek_rules[1:]
         for s in subcourses:
             log.debug(sizer.describe(len(s.students_no_phantoms)))
     else:
@@ -100,119 +310,558 @@ def run(input_deck):
         log.debug("Initialized Course")
         log.debug(sizer.describe(len(students)))
 
-    run_name = os.path.splitext(input_deck)[0]
-    # get rid of relative path
-    run_name = os.path.split(run_name)[1]
+    restarts = dek.get('restarts', 1)
+    if restart_override is not None:
+        restarts = restart_override
+    if restarts > 1:
+        log.debug('Keeping the best of {} restarts'.format(restarts))
 
-    outdir = 'groups_{0}_{1}'.format(run_name,
-                                     time.strftime('%Y-%m-%d_%H-%M-%S'))
+    solutions = solve_all(subcourses, dek_rules, identifier, options, restarts,
+                          parallel)
+    log.debug("applied rules")
 
-    os.mkdir(outdir)
-    log.debug('Made output directory')
-    os.chdir(outdir)
-    # return the full output directory.
-    full_outdir = os.getcwd()
+    for solution in solutions:
+        if options['matrix']:
+            # score the final groups for the output in one vectorized pass
+            matrix.remember_checks(solution.rules, solution.groups)
+            log.debug("checked groups with matrix engine")
 
-    def outfile(o):
-        return open('{0}_{1}'.format(run_name,o),'w')
+    return Grouping(solutions, identifier)
 
-    group_number_offset = 0
-    all_groups = []
-    for course in subcourses:
-        rules = [make_rule(r, course) for r in dek_rules]
-        log.debug("Made rules")
+def split_class(students, dek_rules):
+    """
+    Split the class on a leading aggregate rule
+
+    This adds support for a "Hard" aggregate. If your first rule is
+    aggregate, we split the class on that attribute and treat each value as a
+    separate class. This ensures that we meet the rule exactly (adding extra
+    phantoms as necessary). This is useful for things like needing all of the
+    students in groups to be in the same recitation section.
+
+    Returns
+    -------
+    subclasses: list<list<Student>> or None
+        Students with each value of the attribute, or None if the first rule
+        is not an aggregate
+    dek_rules: list<dict>
+        The rules left to apply within each subclass
+    """
+    if len(dek_rules) > 0 and dek_rules[0]['name'] == 'aggregate':
+        attribute = dek_rules[0]['attribute']
+        # Sort into a list so that ordering (and so group numbering) is
+        # preserved when we use this in multiple places and between runs
+        split_values = sorted(set(s[attribute] for s in students), key=str)
+        subclasses = [[s for s in students if s[attribute] == value]
+                      for value in split_values]
+        return subclasses, dek_rules[1:]
+    return None, dek_rules
+
+class Grouping(object):
+    """
+    Finished groups for a whole class
+
+    Attributes
+    ----------
+    groups: list<Group>
+        Groups, in group number order, without phantoms
+    students: list<Student>
+        Everyone in groups, ordered by group
+    rules: list<Rule>
+        Rules the groups were made with, phantom distribution first
+    balance_rules: list<Balance>
+        The balance rules among rules
+    suceeded: bool
+        True if all rules were met
+    stats: instrument.Stats
+        Counts and times of the work the solver did, by rule (empty unless
+        stats were asked for)
+    summaries: dict
+        Group -> GroupSummary
+    problems: list<feasibility.Problem>
+        Rules found to be impossible before grouping
+    """
+    def __init__(self, solutions, identifier):
+        self.solutions = solutions
+        self.identifier = identifier
+        groups = []
+        students = []
+        self.problems = []
+        self.suceeded = True
+        self.stats = instrument.Stats()
+        for solution in solutions:
+            # solutions may come back from worker processes as copies, so take
+            # the course, rules and groups from the solution from here on
+            groups = groups + solution.groups
+            students = students + solution.course.students_no_phantoms
+            self.suceeded = solution.suceeded and self.suceeded
+            self.stats.merge(solution.stats)
+            self.problems.extend(solution.problems)
+            self.rules = solution.rules
+            self.balance_rules = solution.balance_rules
+
+        self.groups = sorted(groups, key=group_sort_key)
+        self.students = sort_students(self.groups, students)
+        self.summaries = summarize(self.groups, self.rules, self.balance_rules,
+                                   identifier)
+
+    def failures(self):
+        """
+        Groups failing each rule (other than phantom distribution)
+
+        Returns
+        -------
+        failures: OrderedDict
+            rule -> list of groups that do not satisfy it
+        """
+        return OrderedDict((r, [g for g in self.groups
+                                if r in self.summaries[g].failed])
+                           for r in self.rules[1:])
+
+    def as_dict(self):
+        """
+        The grouping as plain lists and dicts (for json)
+        """
+        return {'suceeded': self.suceeded,
+                'groups': [{'number': g.group_number,
+                            'students': self.summaries[g].members}
+                           for g in self.groups],
+                'failures': dict((str(r), [g.group_number for g in groups])
+                                 for r, groups in self.failures().items()),
+                'problems': [str(p) for p in self.problems],
+                'stats': self.stats.as_dict()}
+
+    def write(self, out, input_deck_name, classlist, write_stats=False):
+        """
+        Write the standard output files
+
+        Parameters
+        ----------
+        out: OutputDirectory or OutputArchive
+            Where to write the files
+        input_deck_name, classlist: string
+            Names to record in the statistics
+        write_stats: bool
+            Also write the solver statistics as json
+        """
+        write_output(out, self.groups, self.students, self.rules,
+                     self.balance_rules, self.identifier, input_deck_name,
+                     classlist, self.summaries, self.problems)
+        if write_stats:
+            with out.open('solver_stats.json') as outf:
+                self.stats.write_json(outf)
+
+class Solution(object):
+    """
+    Groups made for a course along with the rules used to make them
+    """
+    def __init__(self, course, rules, balance_rules, groups, suceeded,
+                 stats=None, problems=None):
+        self.course = course
+        self.stats = stats
+        # feasibility.Problems found before grouping
+        self.problems = problems or []
+        self.rules = rules
+        self.balance_rules = balance_rules
+        self.groups = groups
+        self.suceeded = suceeded
+
+    def failures(self):
+        return sum(1 - g.satisfies_rule(r) for r in self.rules
+                   for g in self.groups)
+
+    def spread(self):
+        # Std Dev of group means summed over the balance rules, like the
+        # number reported in statistics.txt
+        total = 0
+        for r in self.balance_rules:
+            means = []
+            for g in self.groups:
+                try:
+                    means.append(g.mean(r.attribute))
+                except EmptyMean:
+                    pass
+            if means:
+                total += std(means)
+        return total
+
+    @property
+    def score(self):
+        # lower is better
+        return self.failures(), self.spread()
+
+def rule_columns(dek):
+    """
+    Class list columns the rules in an input deck refer to
+    """
+    return set(r['attribute'] for r in dek['rules'])
 
-        balance_rules = filter(lambda x: isinstance(x, Balance), rules)
+def solver_options(dek):
+    """
+    Pull the settings that control the solver out of an input deck
+    """
+    options = {'tries': dek.get('tries', 5),
+               'solver': dek.get('solver', 'greedy'),
+               'patience': dek.get('patience'),
+               'time_limit': dek.get('time_limit'),
+               'seed': dek.get('seed'),
+               # vectorized rule checks, only if asked for since they need
+               # numpy and only pay off for big classes
+               'matrix': dek.get('matrix_engine', False),
+               # annealing scrambles its starting groups anyway, so only the
+               # greedy solver gains from a constructive start
+               'initial': dek.get('initial', 'constructive'
+                                  if dek.get('solver', 'greedy') == 'greedy'
+                                  else 'stratified')}
+    if options['solver'] not in solvers:
+        raise SolverNotImplemented(options['solver'])
+    if options['initial'] not in initial_groups:
+        raise InitialNotImplemented(options['initial'])
+    if options['matrix'] and not matrix.available:
+        raise matrix.NumpyNotAvailable()
+    return options
+
+def solve(course, dek_rules, identifier, options, group_number_offset=0,
+          seed=None):
+    """
+    Make groups for a course
 
-        groups = make_initial_groups(course, balance_rules, group_number_offset)
+    Parameters
+    ----------
+    course: Course
+        Students to group, the course is modified in place
+    dek_rules: list<dict>
+        Rule specifications from the input deck
+    identifier: string
+        Student identifier attribute
+    options: dict
+        Solver settings, see solver_options
+    group_number_offset: int
+        Groups are numbered starting after this
+    seed: (optional)
+        Seed for this solve's random number generator, if None it is seeded
+        unpredictably
+
+    Returns
+    -------
+    solution: Solution
+        Phantoms have been removed from the course and groups
+    """
+    with instrument.collect(options.get('stats', False)) as stats:
+        solution = _solve(course, dek_rules, identifier, options,
+                          group_number_offset, random.Random(seed))
+    solution.stats = stats
+    return solution
+
+def _solve(course, dek_rules, identifier, options, group_number_offset, rng):
+    rules = [make_rule(r, course) for r in dek_rules]
+    log.debug("Made rules")
+    problems = analyze(rules, course)
+
+    balance_rules = [r for r in rules if isinstance(r, Balance)]
+
+    groups = initial_groups[options['initial']](course, rules, balance_rules,
+                                                group_number_offset, rng)
+    log.debug("Made initial groups")
+
+    # Add a rule to distribute phantoms to avoid having more than one phantom
+    # per group, put it first so that it is highest priority
+    # we have to add this after the phantoms are created by
+    # group.make_initial_groups so that it can see the phantoms
+    rules = [Distribute(identifier, course, 'phantom')] + rules
+
+    suceeded = solvers[options['solver']](rules, groups, course.students,
+                                          options, rng)
+
+    groups.sort(key = group_sort_key)
+
+    if sum(1 - g.satisfies_rule(rules[0]) for g in groups) != 0:
+        raise UnevenGroups()
+
+    # now get rid of the phantoms so they don't affect the output
+    for group in groups:
+        group.students = [s for s in group.students if s.data[identifier] !=
+                          'phantom']
+
+    course.students = [s for s in course.students if s.data[identifier] != 'phantom']
+    log.debug("removed phantoms")
+
+    return Solution(course, rules, balance_rules, groups, suceeded,
+                    problems=problems)
+
+def solve_all(courses, dek_rules, identifier, options, restarts=1,
+              parallel=True):
+    """
+    Solve each of courses, restarts times each with independent seeds, and
+    keep the best solution for each course (fewest rule failures, ties go to
+    the smallest spread in balanced group means).
+
+    Courses (and restarts) are independent, so when there is more than one
+    solve to do they are run in separate processes, unless parallel is False
+    (say because we are already in a worker process).  Groups are numbered
+    consecutively through the courses in the order given regardless of which
+    finishes first.
+
+    Returns
+    -------
+    solutions: list<Solution>
+        Best solution for each course, in the same order as courses
+    """
+    offsets = []
+    group_number_offset = 0
+    for course in courses:
+        offsets.append(group_number_offset)
         group_number_offset += course.n_groups
-        log.debug("Made initial groups")
-        def failures(r):
-            return sum(1- r.check(g) for g in groups)
 
+    if len(courses) == 1 and restarts <= 1:
+        return [solve(courses[0], dek_rules, identifier, options, 0,
+                      options.get('seed'))]
+
+    # give every solve its own stream, derived from the deck's seed (if there
+    # is one) so the whole run is reproducible
+    rng = random.Random(options.get('seed'))
+    seeds = [[rng.randrange(2**32) for i in range(restarts)]
+             for course in courses]
+    if parallel:
+        with ProcessPoolExecutor() as pool:
+            futures = [[pool.submit(solve, course, dek_rules, identifier,
+                                    options, offset, seed)
+                        for seed in course_seeds]
+                       for course, offset, course_seeds in zip(courses, offsets,
+                                                               seeds)]
+            candidates = [[f.result() for f in course_futures]
+                          for course_futures in futures]
+    else:
+        # solve modifies the course, so each restart works on its own copy
+        # (as it would have in a worker process)
+        candidates = [[solve(copy.deepcopy(course), dek_rules, identifier,
+                             options, offset, seed)
+                       for seed in course_seeds]
+                      for course, offset, course_seeds in zip(courses, offsets,
+                                                              seeds)]
+
+    solutions = []
+    for course_candidates, course_seeds in zip(candidates, seeds):
+        for seed, solution in zip(course_seeds, course_candidates):
+            log.debug('Seed {}: {} failures, spread {}'.format(
+                seed, *solution.score))
+        solutions.append(min(course_candidates, key=attrgetter('score')))
+    return solutions
+
+output_buffer = 1 << 16
+
+class OutputDirectory(object):
+    """
+    Output files written into a new directory
+    """
+    def __init__(self, path, run_name):
+        os.mkdir(path)
+        self.path = path
+        self.run_name = run_name
 
+    def open(self, name):
+        return open(os.path.join(self.path, '{0}_{1}'.format(self.run_name,
+                                                             name)),
+                    'w', buffering=output_buffer)
 
-        # Add a rule to distribute phantoms to avoid having more than one phantom
-        # per group, put it first so that it is highest priority
-        # we have to add this after the phantoms are created by
-        # group.make_initial_groups so that it can see the phantoms
-        rules = [Distribute(identifier, course, 'phantom')] + rules
+    def close(self):
+        pass
 
-        suceeded = apply_rules_list(rules, groups, course.students, tries=tries)
-        log.debug("applied rules")
+    def __enter__(self):
+        return self
 
-        groups.sort(key = group_sort_key)
+    def __exit__(self, *exc):
+        self.close()
 
+class OutputArchive(OutputDirectory):
+    """
+    Output files written into a single compressed zip archive
+    """
+    def __init__(self, path, run_name):
+        self.path = path + '.zip'
+        self.run_name = run_name
+        # files go in a folder named like the output directory would be
+        self.folder = os.path.basename(path)
+        self.archive = zipfile.ZipFile(self.path, 'w', zipfile.ZIP_DEFLATED)
+
+    def open(self, name):
+        info = zipfile.ZipInfo('{0}/{1}_{2}'.format(
+            self.folder, self.run_name, name), time.localtime()[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED
+        member = self.archive.open(info, 'w')
+        return io.TextIOWrapper(io.BufferedWriter(member, output_buffer))
+
+    def close(self):
+        self.archive.close()
+
+class OutputMemory(object):
+    """
+    Output files kept in memory
 
-        if failures(rules[0]) !=  0:
-            raise UnevenGroups()
+    Attributes
+    ----------
+    files: dict
+        File name -> contents
+    """
+    def __init__(self, run_name):
+        self.path = None
+        self.run_name = run_name
+        self.files = {}
 
-        # now get rid of the phantoms so they don't affect the output
-        for group in groups:
-            group.students = [s for s in group.students if s.data[identifier] !=
-                              'phantom']
+    def open(self, name):
+        return _MemoryFile(self.files, '{0}_{1}'.format(self.run_name, name))
 
-        course.students = [s for s in course.students if s.data[identifier] != 'phantom']
-        log.debug("removed phantoms")
+    def close(self):
+        pass
 
-        all_groups = all_groups + groups
+    def __enter__(self):
+        return self
 
-    students = sorted(students, key=group_sort_key)
+    def __exit__(self, *exc):
+        self.close()
 
-    ########################################################################
-    # Output
-    ########################################################################
-    group_output(all_groups, outfile('groups.csv'), identifier)
-    group_output(all_groups, outfile('groups.txt'), identifier, sep = '\n')
-    statistics(rules, all_groups, students, balance_rules, input_deck, dek['classlist'], outfile('statistics.txt'))
+class _MemoryFile(io.StringIO):
+    def __init__(self, files, name):
+        super(_MemoryFile, self).__init__()
+        self._files = files
+        self._name = name
 
-    student_full_output(students, identifier, outfile('classlist.csv'))
-    student_augmented_output(students, rules, outfile('details.csv'))
-    log.debug("wrote output")
+    def close(self):
+        if not self.closed:
+            self._files[self._name] = self.getvalue()
+        super(_MemoryFile, self).close()
+
+class GroupSummary(object):
+    """
+    Facts about a group shared by the output files, computed once
+
+    Attributes
+    ----------
+    members: list<string>
+        Identifiers of the group's students, sorted
+    means: list<float>
+        Group mean for each balance rule, None if nobody in the group has a
+        value for it
+    failed: list<Rule>
+        Rules the group does not satisfy
+    """
+    def __init__(self, group, rules, balance_rules, identifier):
+        self.members = [str(s[identifier]) for s in
+                        sorted(group.students, key=lambda x: x[identifier])]
+        self.means = [group_mean(group, r) for r in balance_rules]
+        self.failed = [r for r in rules if not group.satisfies_rule(r)]
 
-    # change back to current working directory
-    os.chdir(cwd)
+def group_mean(group, rule):
+    try:
+        return mean(group, rule.get_strength)
+    except EmptyMean:
+        return None
+
+def summarize(groups, rules, balance_rules, identifier):
+    return dict((g, GroupSummary(g, rules, balance_rules, identifier))
+                for g in groups)
 
-    return suceeded, full_outdir
+def sort_students(groups, students):
+    """
+    Order students by group, groups in group_sort_key order
+    """
+    rank = dict((g, i) for i, g in
+                enumerate(sorted(groups, key=group_sort_key)))
+    return sorted(students, key=lambda s: rank[s.group])
 
-def statistics(rules, groups, students, balance_rules, input_deck_name, classlist, outf):
-    def failures(r):
-        return sum(1- r.check(g) for g in groups)
+def write_output(out, groups, students, rules, balance_rules, identifier,
+                 input_deck_name, classlist, summaries=None, problems=None):
+    """
+    Write all of the standard output files
+
+    Parameters
+    ----------
+    out: OutputDirectory or OutputArchive
+        Where to write the files
+    groups: list<Group>
+        Finished groups, without phantoms
+    students: list<Student>
+        Everyone in groups
+    rules: list<Rule>
+        Rules the groups were made with, phantom distribution first
+    balance_rules: list<Balance>
+        The balance rules among rules
+    identifier: string
+        Student identifier attribute
+    input_deck_name, classlist: string
+        Names to record in the statistics
+    summaries: dict (optional)
+        Group -> GroupSummary, computed if not given
+    problems: list<feasibility.Problem> (optional)
+        Rules found to be impossible, listed in the statistics
+    """
+    groups = sorted(groups, key=group_sort_key)
+    students = sort_students(groups, students)
+    if summaries is None:
+        summaries = summarize(groups, rules, balance_rules, identifier)
+    with out.open('groups.csv') as outf:
+        group_output(groups, outf, identifier, summaries=summaries)
+    with out.open('groups.txt') as outf:
+        group_output(groups, outf, identifier, sep='\n', summaries=summaries)
+    with out.open('statistics.txt') as outf:
+        statistics(rules, groups, students, balance_rules, input_deck_name,
+                   classlist, outf, summaries, problems)
+    with out.open('classlist.csv') as outf:
+        student_full_output(students, identifier, outf)
+    with out.open('details.csv') as outf:
+        student_augmented_output(students, rules, outf, summaries,
+                                 balance_rules)
+
+def statistics(rules, groups, students, balance_rules, input_deck_name,
+               classlist, outf, summaries=None, problems=None):
+    if summaries is None:
+        summaries = summarize(groups, rules, balance_rules,
+                              students[0].identifier)
+    n_fail = Counter(r for g in groups for r in summaries[g].failed)
 
     outf.write('Ran GroupEng on: {0} with students from {1}\n\n'.format(
             input_deck_name, classlist))
 
     outf.write('Made {0} groups\n\n'.format(len(groups)))
 
+    if problems:
+        outf.write('Some rules could not be met by any grouping:\n')
+        for p in problems:
+            outf.write('    {0}\n'.format(p))
+        outf.write('\n')
+
     for r in rules[1:]:
-        n_fail = failures(r)
         if isinstance(r, Balance):
-            group_means = sorted([mean(g, r.get_strength) for g in groups])
+            i = balance_rules.index(r)
+            group_means = sorted(summaries[g].means[i] for g in groups
+                                 if summaries[g].means[i] is not None)
             attr = r.attribute
-            outf.write('{0} groups failed:'.format(n_fail))
+            outf.write('{0} groups failed:'.format(n_fail[r]))
             outf.write('{0}: '.format(r))
             outf.write('Class {0} Mean: {1:3.2f}, '.format(
                     attr, mean(students, r.get_strength)))
             outf.write('Class {0} Std Dev: {1:3.2f}, '.format(
                         attr, std(students, r.get_strength)))
-            outf.write('Std Dev of Group {0} Means: {1:3.2f}'.format(
-                    attr, std(group_means)))
+            if group_means:
+                outf.write('Std Dev of Group {0} Means: {1:3.2f}'.format(
+                        attr, std(group_means)))
             outf.write('\n\n')
         else:
-            outf.write('{0} groups failed: {1}\n\n'.format(n_fail, r))
+            outf.write('{0} groups failed: {1}\n\n'.format(n_fail[r], r))
 
     outf.write('Group Summaries\n')
     outf.write('---------------\n')
 
     for g in groups:
+        summary = summaries[g]
         outf.write('Group {0}: '.format(g.group_number))
         items = []
-        for r in balance_rules:
-            items.append('<{0} Mean: {1:3.2f}>'.format(
-                    r.attribute, mean(g, r.get_strength)))
-        for r in rules:
-            if not r.check(g):
-                items.append('Failed {0}'.format(r))
+        for r, m in zip(balance_rules, summary.means):
+            if m is None:
+                items.append('<No {0}>'.format(r.attribute))
+            else:
+                items.append('<{0} Mean: {1:3.2f}>'.format(r.attribute, m))
+        for r in summary.failed:
+            items.append('Failed {0}'.format(r))
         outf.write(', '.join(items))
         outf.write('\n')
 
@@ -225,44 +874,51 @@ def group_sort_key(g):
     except AttributeError:
         return g.group_number
 
-def group_output(groups, outf, identifier, sep = ', '):
+def group_output(groups, outf, identifier, sep = ', ', summaries=None):
     for g in groups:
-        students = sorted(g.students, key = lambda x: x[identifier])
+        if summaries is not None:
+            members = summaries[g].members
+        else:
+            members = [str(s[identifier]) for s in
+                       sorted(g.students, key = lambda x: x[identifier])]
         outf.write('Group {0}{1}{2}\n'.format(g.group_number, sep,
-                                             sep.join([str(s[identifier]) for s in
-                                                       students])))
+                                             sep.join(members)))
 
 def student_full_output(students, identifier, outf):
     writer = csv.writer(outf)
     writer.writerow((students[0].headers))
-    for s in students:
-        writer.writerow(s.full_record())
+    writer.writerows(s.full_record() for s in students)
 
 
-def student_augmented_output(students, rules, outf):
+def student_augmented_output(students, rules, outf, summaries=None,
+                             balance_rules=None):
+    if balance_rules is None:
+        balance_rules = [r for r in rules if r.name == 'Balance']
     add_headers = ['']
-    balance_rules = [r for r in rules if r.name == 'Balance']
     add_headers += ["group {0} mean".format(r.attribute) for r in balance_rules]
     add_headers += ["Rules Broken"]
     headers = students[0].headers
+    if summaries is None:
+        summaries = summarize(set(s.group for s in students), rules,
+                              balance_rules, students[0].identifier)
 
     writer = csv.writer(outf)
     writer.writerow(headers+add_headers)
 
-    group_number = students[0].group_number
+    group = students[0].group
     num_student_headers = len(students[0].headers)
-    for i, s in enumerate(students):
+    for s in students:
         # write out a summary of the previous group if we have gone to the next
         # group
-        if s.group_number != group_number:
-            group = students[i-1].group
-            summary = ['summary']
-            summary += [''] * num_student_headers
-            summary += [str(mean(group.students, r.get_strength)) for r in balance_rules]
-            summary += ["{}: {}".format(r.name, r.attribute) for r in rules if
-                        not r.check(group.students)]
-            writer.writerow(summary)
+        if s.group is not group:
+            summary = summaries[group]
+            row = ['summary']
+            row += [''] * num_student_headers
+            row += ['' if m is None else str(m) for m in summary.means]
+            row += ["{}: {}".format(r.name, r.attribute) for r in
+                    summary.failed]
+            writer.writerow(row)
             writer.writerow([])
-            group_number = s.group_number
+            group = s.group
 
         writer.writerow(s.full_record())
@@ -114,17 +114,37 @@ class Course(object):
 
         phantoms_needed = self.group_size * self.n_groups - n
         def make_phantom():
-            data = dict([(key, None) for key in self.students[0].data.keys()])
-            identifier = self.students[0].identifier
-            data[identifier] = 'phantom'
-            return Student(data, identifier=identifier, headers =
-                           self.students[0].headers)
+            schema = self.students[0].schema
+            phantom = Student(schema=schema,
+                              values=[None] * len(schema.loaded))
+            phantom.data[schema.identifier] = 'phantom'
+            return phantom
 
         self.students += [make_phantom() for i in range(int(phantoms_needed))]
+        # attribute -> {value: [students with that value]}, built on first use
+        self._index = {}
 
     def attr_values(self, attr):
         return remove_none(set(s[attr] for s in self.students))
 
+    def students_with(self, attr, values):
+        """
+        Students (including phantoms) whose attr is values, or one of values if
+        it is a list or tuple.  Students keep track of their own group, so this
+        stays valid as students are swapped around.  For a single value this
+        is the index's own list, so copy it before changing it.
+        """
+        try:
+            index = self._index[attr]
+        except KeyError:
+            index = {}
+            for s in self.students:
+                index.setdefault(s[attr], []).append(s)
+            self._index[attr] = index
+        if isinstance(values, (list, tuple)):
+            return [s for v in values for s in index.get(v, [])]
+        return index.get(values, [])
+
 def remove_none(s):
     try:
         s.remove(None)
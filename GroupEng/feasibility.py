@@ -0,0 +1,177 @@
+# Copyright 2011, Thomas G. Dimiduk
+#
+# This file is part of GroupEng.
+#
+# GroupEng is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# GroupEng is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with GroupEng.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Checks for rules that cannot be met, made before searching for groups.
+
+A rule can be impossible on its own (a cluster value only one student has,
+more aggregate values than there are groups to hold them) or only in
+combination with a higher priority rule (a distribute value that can't reach
+every group once students are aggregated).  Either way no amount of retrying
+will get every group to meet it, but retrying still cuts down how many groups
+fail, so the problems found are only reported.
+
+.. moduleauthor:: Thomas G. Dimiduk tgd8@cornell.edu
+"""
+
+import logging
+import math
+
+from .rule import Aggregate, Balance, Cluster, Distribute, number
+
+log = logging.getLogger('log')
+
+class Problem(object):
+    """
+    A reason rule cannot be met
+
+    Parameters
+    ----------
+    rule: Rule
+        The rule that can't be met
+    message: string
+        Why not
+    conflict: Rule (optional)
+        Higher priority rule that rule conflicts with, None if rule is
+        impossible on its own
+    """
+    def __init__(self, rule, message, conflict=None):
+        self.rule = rule
+        self.message = message
+        self.conflict = conflict
+
+    def __str__(self):
+        if self.conflict is not None:
+            return '{0} conflicts with {1}: {2}'.format(self.rule,
+                                                        self.conflict,
+                                                        self.message)
+        return '{0} cannot be met: {1}'.format(self.rule, self.message)
+
+def value_name(value):
+    if isinstance(value, tuple):
+        return ' or '.join(str(v) for v in value)
+    return str(value)
+
+def check_cluster(rule, course):
+    for value in rule.values:
+        n = number(course.students, rule.attribute, value)
+        if n == 1:
+            yield Problem(rule, 'only one student is {0}'.format(
+                value_name(value)))
+        elif n > 1 and course.group_size < 2:
+            yield Problem(rule, 'groups are too small to hold two {0} '
+                          'students'.format(value_name(value)))
+        elif n > 1 and 2 * int(math.ceil(n / course.group_size)) > n:
+            # it takes at least this many groups to hold them all, and each
+            # of those groups needs two of them
+            yield Problem(rule, "{0} {1} students can't be split into groups "
+                          'of 2 to {2}'.format(n, value_name(value),
+                                               course.group_size))
+
+def check_aggregate(rule, course):
+    # every group needs exactly one value, and each value needs enough
+    # groups to hold all of its students
+    counts = dict((v, number(course.students, rule.attribute, v))
+                  for v in rule.all_values)
+    needed = sum(int(math.ceil(n / course.group_size))
+                 for n in counts.values())
+    if needed > course.n_groups:
+        yield Problem(rule, 'holding every {0} value in groups of its own '
+                      'takes {1} groups but there are only {2}'.format(
+                          rule.attribute, needed, course.n_groups))
+    valued = sum(counts.values())
+    if valued < course.n_groups:
+        yield Problem(rule, 'only {0} students have a {1} for {2} '
+                      'groups'.format(valued, rule.attribute,
+                                      course.n_groups))
+
+def check_balance(rule, course):
+    if not rule.tol > 0:
+        # groups have to be strictly within tol of the class mean
+        yield Problem(rule, 'the tolerance is 0 (every student has the same '
+                      '{0} or tol is 0), which no group can be within'.format(
+                          rule.attribute))
+    # phantoms are given the weakest strength when the groups are made (see
+    # group.strength_tiles), so they count too
+    have = sum(1 for s in course.students if rule.get_strength(s) is not None
+               or s[s.identifier] == 'phantom')
+    if have < course.n_groups:
+        yield Problem(rule, 'only {0} students have a {1} for {2} '
+                      'groups'.format(have, rule.attribute, course.n_groups))
+
+def check_distribute_after_aggregate(rule, aggregate, course):
+    # groups are all one aggregate value, so a group can only get the
+    # distributed students that share its value (or have none)
+    for value in rule.values:
+        least = min(rule._target_numbers(value))
+        if least < 1:
+            continue
+        by_aggregate = {}
+        for s in course.students_with(rule.attribute, value):
+            key = s[aggregate.attribute]
+            by_aggregate[key] = by_aggregate.get(key, 0) + 1
+        flexible = by_aggregate.get(None, 0)
+        for a in aggregate.all_values:
+            n_a = number(course.students, aggregate.attribute, a)
+            groups_a = int(math.ceil(n_a / course.group_size))
+            have = by_aggregate.get(a, 0) + flexible
+            if have < least * groups_a:
+                yield Problem(rule, 'every group needs {0} {1} but the {2} '
+                              'groups of {3} {4} can only get {5}'.format(
+                                  int(least), value_name(value), groups_a,
+                                  aggregate.attribute, a, have),
+                              conflict=aggregate)
+                break
+
+def analyze(rules, course):
+    """
+    Find rules that cannot be met for a course
+
+    Parameters
+    ----------
+    rules: list<Rule>
+        Rules in priority order
+    course: Course
+        The course the rules were made for
+
+    Returns
+    -------
+    problems: list<Problem>
+    """
+    problems = []
+    aggregates = []
+    for rule in rules:
+        if isinstance(rule, Cluster):
+            found = list(check_cluster(rule, course))
+        elif isinstance(rule, Aggregate):
+            found = list(check_aggregate(rule, course))
+        elif isinstance(rule, Balance):
+            found = list(check_balance(rule, course))
+        elif isinstance(rule, Distribute):
+            found = [p for a in aggregates
+                     for p in check_distribute_after_aggregate(rule, a,
+                                                               course)]
+        else:
+            found = []
+        if isinstance(rule, Aggregate) and not found:
+            # only an aggregate that can be met will keep groups to one value
+            aggregates.append(rule)
+        for p in found:
+            log.debug('Feasibility: {0}'.format(p))
+            rule.feasible = False
+        problems.extend(found)
+    return problems
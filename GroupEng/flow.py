@@ -0,0 +1,221 @@
+# Copyright 2011, Thomas G. Dimiduk
+#
+# This file is part of GroupEng.
+#
+# GroupEng is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# GroupEng is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with GroupEng.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Exact placement for distribute rules as a flow problem.
+
+How many students with each value go in each group is a transportation
+problem: every value has a supply of students, every group takes a fixed
+number of students, and the number of each value in each group has to be
+within the rule's target numbers.  Starting from the current groups (which
+already have the right sizes and supplies) every group and value that is out
+of bounds is fixed by an augmenting cycle through the residual graph, as in
+Ford-Fulkerson.  Following a cycle moves one student out of and one student
+into each group on it, which is a swap as far as each group can tell, so the
+moves are only made if every group's higher priority rules permit them (see
+group.valid_swap).  Cycles are found by breadth first search, so they are as
+short as possible and few students move.
+
+.. moduleauthor:: Thomas G. Dimiduk tgd8@cornell.edu
+"""
+
+import random
+from collections import deque
+
+from . import instrument
+from .student import attribute_match
+
+# tries at picking students to follow a cycle with before giving up on it
+attempts = 8
+
+class Placement(object):
+    """
+    Counts of each value of a rule in each group, and the residual graph
+    they define
+
+    Value v (an index into rule.values, or len(rule.values) for students with
+    none of them) can join group g if it has fewer than the most students
+    with v allowed and can leave g if it has more than the fewest.
+    """
+    def __init__(self, rule, groups):
+        self.rule = rule
+        self.groups = groups
+        self.matches = [attribute_match(rule.attribute, v)
+                        for v in rule.values]
+        self.other = len(rule.values)
+        self.low = [min(rule._target_numbers(v)) for v in rule.values] + [0]
+        self.high = ([max(rule._target_numbers(v)) for v in rule.values] +
+                     [float('inf')])
+        self.counts = [[0] * (self.other + 1) for g in groups]
+        for i, g in enumerate(groups):
+            for s in g.students:
+                self.counts[i][self.value(s)] += 1
+
+    def value(self, s):
+        for v, match in enumerate(self.matches):
+            if match(s):
+                return v
+        return self.other
+
+    def in_bounds(self, v, i):
+        return self.low[v] <= self.counts[i][v] <= self.high[v]
+
+    def out_of_bounds(self):
+        return [(v, i) for i in range(len(self.groups))
+                for v in range(self.other) if not self.in_bounds(v, i)]
+
+    def can_join(self, v, i):
+        return self.counts[i][v] < self.high[v]
+
+    def can_leave(self, v, i):
+        return self.counts[i][v] > self.low[v]
+
+    def cycle(self, v, i):
+        """
+        Moves that bring value v in group i closer to its bounds without
+        putting any other value in any group further out of them
+
+        Returns
+        -------
+        moves: list<(value, from group, to group)> or None if there are none
+        """
+        too_many = self.counts[i][v] > self.high[v]
+        # search from the value leaving group i to group i when there are
+        # too many, or from group i to the value joining it when there are
+        # too few.  Nodes are ('v', value) and ('g', group)
+        if too_many:
+            start, goal = ('v', v), ('g', i)
+        else:
+            start, goal = ('g', i), ('v', v)
+
+        def nexts(node):
+            kind, n = node
+            if kind == 'v':
+                return (('g', j) for j in range(len(self.groups))
+                        if self.can_join(n, j) and (n, j) != (v, i))
+            return (('v', w) for w in range(self.other + 1)
+                    if self.can_leave(w, n) and (w, n) != (v, i))
+
+        def reaches_goal(node):
+            # is the goal one step from node?  Checking as nodes are found
+            # saves expanding a whole layer of the search
+            kind, n = node
+            if too_many:
+                return kind == 'v' and n != v and self.can_join(n, i)
+            return kind == 'g' and n != i and self.can_leave(v, n)
+
+        parent = {start: None}
+        queue = deque([start])
+        found = None
+        while queue and found is None:
+            node = queue.popleft()
+            for nxt in nexts(node):
+                if nxt not in parent:
+                    parent[nxt] = node
+                    if reaches_goal(nxt):
+                        found = nxt
+                        break
+                    queue.append(nxt)
+        if found is None:
+            return None
+        parent[goal] = found
+
+        path = []
+        node = goal
+        while node is not None:
+            path.append(node)
+            node = parent[node]
+        path.reverse()
+        # close the cycle through (v, i)
+        if too_many:
+            path = [('g', i)] + path
+        else:
+            path = path + [('g', i)]
+        # path alternates group, value, group, ...: each value leaves the
+        # group before it for the group after it
+        return [(path[k][1], path[k-1][1], path[k+1][1])
+                for k in range(1, len(path), 2)]
+
+    def follow(self, moves, rng=random):
+        """
+        Move students along a cycle, if some choice of students lets every
+        group keep its rules
+
+        Returns
+        -------
+        moved: bool
+        """
+        candidates = [[s for s in self.groups[a].students
+                       if self.value(s) == w] for w, a, b in moves]
+        for attempt in range(attempts):
+            chosen = [rng.choice(c) for c in candidates]
+            # each group loses the student moving out of it and gains the one
+            # moving in
+            leaving = dict((a, s) for s, (w, a, b) in zip(chosen, moves))
+            if all(permitted(self.groups[b], leaving[b], s)
+                   for s, (w, a, b) in zip(chosen, moves)):
+                break
+        else:
+            return False
+        for s, (w, a, b) in zip(chosen, moves):
+            self.groups[a].remove(s)
+            self.counts[a][w] -= 1
+        for s, (w, a, b) in zip(chosen, moves):
+            self.groups[b].add(s)
+            self.counts[b][w] += 1
+        return True
+
+def permitted(group, leaving, joining):
+    return all(r.permissable_swap(group, leaving, joining)
+               for r in group.rules)
+
+def place(rule, groups, rng=random):
+    """
+    Move students so every group has an acceptable number of each of rule's
+    values, as far as the groups' other rules allow
+
+    Parameters
+    ----------
+    rule: Distribute
+        Rule whose target numbers to meet
+    groups: list<Group>
+        Groups to fix, modified in place
+    rng: random.Random (optional)
+        Source of random choices, defaults to the random module
+
+    Returns
+    -------
+    fixed: int
+        Number of out of bounds values brought into bounds
+    """
+    stats = instrument.current()
+    placement = Placement(rule, groups)
+    if any(sum(1 for match in placement.matches if match(s)) > 1
+           for g in groups for s in g.students):
+        # overlapping values are not a transportation problem
+        return 0
+    fixed = 0
+    for v, i in placement.out_of_bounds():
+        while not placement.in_bounds(v, i):
+            moves = placement.cycle(v, i)
+            if moves is None or not placement.follow(moves, rng):
+                break
+            stats.count('flow_cycles')
+            stats.count('flow_moves', n=len(moves))
+        else:
+            fixed += 1
+    return fixed
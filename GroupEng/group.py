@@ -23,7 +23,11 @@ groups.
 """
 
 from . import student
+from . import instrument
+from .errors import EmptyMean
 import random
+import time
+from collections import Counter
 
 class Group(object):
     """
@@ -41,12 +45,24 @@ class Group(object):
         :type students:
 
         """
-        self.students = students
         self.group_number = group_number
         self.number = group_number
+        self.rules = []
+        # rule -> bool, whether this group currently satisfies rule.  Cleared
+        # whenever the membership of the group changes
+        self._satisfied = {}
+        # attribute -> Counter of that attribute's values in the group, built
+        # on first use and kept up to date by add and remove
+        self._counts = {}
+        # attribute -> [sum, n] over students with a value for attribute, so
+        # Balance rules can get group means without walking the group
+        self._totals = {}
+        # bumped on every membership change, so others keeping their own
+        # copy of the group (see matrix.StudentMatrix) can tell it is stale
+        self.changes = 0
+        self.students = students
         for student in students:
             student.group = self
-        self.rules = []
 
     def __str__(self):
         return "<Group {0}: Students {1}>".format(self.group_number,
@@ -56,16 +72,89 @@ class Group(object):
         return "Group(students={0}, group_number={1})".format(
             [repr(s) for s in self.students], self.group_number)
 
-    # TODO: OPTIMIZATION: make this stored and update when swapping students
+    @property
+    def students(self):
+        return self._students
+
+    @students.setter
+    def students(self, students):
+        self._students = students
+        self._counts.clear()
+        self._totals.clear()
+        self.invalidate()
+
+    def invalidate(self):
+        """
+        Forget cached rule results, call this after changing group membership
+        """
+        self._satisfied.clear()
+        self.changes += 1
+
+    def counts(self, attribute):
+        """
+        Counter of the values of attribute among students in this group.
+
+        The returned Counter is shared with the group, do not modify it.
+        """
+        try:
+            return self._counts[attribute]
+        except KeyError:
+            c = Counter(s[attribute] for s in self.students)
+            self._counts[attribute] = c
+            return c
+
+    def number_with(self, attribute, values):
+        """
+        Number of students in the group whose attribute is values (or is one
+        of values if values is a list or tuple)
+        """
+        c = self.counts(attribute)
+        if isinstance(values, (list, tuple)):
+            return sum(c[v] for v in values)
+        return c[values]
+
+    def total(self, attribute):
+        """
+        [sum, n] of attribute over the students in this group that have a
+        value for it.
+
+        The returned list is shared with the group, do not modify it.
+        """
+        try:
+            return self._totals[attribute]
+        except KeyError:
+            values = [s[attribute] for s in self.students
+                      if s[attribute] is not None]
+            t = [sum(values), len(values)]
+            self._totals[attribute] = t
+            return t
+
+    def mean(self, attribute):
+        total, n = self.total(attribute)
+        if n == 0:
+            raise EmptyMean()
+        return total/n
+
     @property
     def happy(self):
         for rule in self.rules:
-            if not rule.check(self):
+            if not self.satisfies_rule(rule):
                 return False
         return True
 
+    def remember(self, rule, ok):
+        """
+        Record a rule result computed elsewhere (see matrix.remember_checks)
+        """
+        self._satisfied[rule] = ok
+
     def satisfies_rule(self, rule):
-        return rule.check(self)
+        try:
+            return self._satisfied[rule]
+        except KeyError:
+            ok = bool(rule.check(self))
+            self._satisfied[rule] = ok
+            return ok
 
     @property
     def size(self):
@@ -82,33 +171,69 @@ class Group(object):
 
     def add(self, s):
         s.group = self
+        for attribute, c in self._counts.items():
+            c[s[attribute]] += 1
+        for attribute, t in self._totals.items():
+            value = s[attribute]
+            if value is not None:
+                t[0] += value
+                t[1] += 1
+        self.invalidate()
         return self.students.append(s)
 
     def remove(self, s):
         if s in self.students:
             s.group = None
+            for attribute, c in self._counts.items():
+                value = s[attribute]
+                c[value] -= 1
+                if not c[value]:
+                    del c[value]
+            for attribute, t in self._totals.items():
+                value = s[attribute]
+                if value is not None:
+                    t[0] -= value
+                    t[1] -= 1
+            self.invalidate()
             return self.students.remove(s)
         else: raise AttemptToRemoveStudentNotInGroup
 
 def valid_swap(s1, s2):
+    if instrument.collecting:
+        return _counted_valid_swap(s1, s2)
     if s1 == s2:
         return False
     if s1.group == s2.group:
         return False
-    l1 = set(s1.group.students)
-    l2 = set(s2.group.students)
-    l1.remove(s1)
-    l1.add(s2)
-    l2.remove(s2)
-    l2.add(s1)
-    def rules_permit(rules, old, new):
-        for r in rules:
-            if not r.permissable_change(old, new):
+    return (rules_permit(s1.group, s1, s2) and
+            rules_permit(s2.group, s2, s1))
+
+def rules_permit(group, leaving, joining):
+    for r in group.rules:
+        if not r.permissable_swap(group, leaving, joining):
+            return False
+    return True
+
+def _counted_valid_swap(s1, s2):
+    # valid_swap, recording what it does in this thread's stats
+    stats = instrument.current()
+    stats.count('valid_swap')
+    if s1 == s2:
+        return False
+    if s1.group == s2.group:
+        return False
+    def counted_permit(group, leaving, joining):
+        for r in group.rules:
+            stats.count('permissable_swap', instrument.label(r))
+            if not r.permissable_swap(group, leaving, joining):
                 return False
         return True
 
-    return (rules_permit(s1.group.rules, s1.group.students, l1) and
-            rules_permit(s2.group.rules, s2.group.students, l2))
+    start = time.perf_counter()
+    ok = (counted_permit(s1.group, s1, s2) and
+          counted_permit(s2.group, s2, s1))
+    stats.add_time('valid_swap', time.perf_counter() - start)
+    return ok
 
 class AttemptToRemoveStudentNotInGroup(Exception):
     pass
@@ -134,15 +259,41 @@ def swap(s1, s2):
     group2.add(s1)
 
 
-def make_initial_groups(course, balance_rules, group_number_offset=0):
+def make_initial_groups(course, balance_rules, group_number_offset=0,
+                        rng=random):
+    mtiles = strength_tiles(course, balance_rules)
 
-    def strengths(s):
-        return [r.get_strength(s) for r in balance_rules]
+    # randomly assort students into groups
+    for mtile in mtiles:
+        rng.shuffle(mtile)
 
+    groups = []
+    i = 0
+    while i < len(mtiles[0]):
+        # grab one student from each mtile
+        g = Group([mtile[i] for mtile in mtiles], i+1+group_number_offset)
+        groups.append(g)
+        i += 1
+
+    return groups
+
+def strengthen_phantoms(course, balance_rules):
+    """
+    Give the course's phantoms the weakest strength for each balance rule
+
+    Returns
+    -------
+    min_strengths: list
+        The weakest strength for each balance rule
+    """
     # Need to find out who the weakest student is, but some students
     # may not have a gpa listed, in that case ignore them and keep
     # looking
-    min_strengths = strengths(min(course.students, key=strengths))
+    min_strengths = []
+    for r in balance_rules:
+        known = [r.get_strength(s) for s in course.students
+                 if r.get_strength(s) is not None]
+        min_strengths.append(min(known) if known else 0)
 
     # Treat phantoms as as weak as the weakest student (some students
     # may be worse than not having no one, but ...)
@@ -151,25 +302,29 @@ def make_initial_groups(course, balance_rules, group_number_offset=0):
         if student[identifier] == 'phantom':
             for i, rule in enumerate(balance_rules):
                 student.data[rule.attribute] = min_strengths[i]
+    return min_strengths
+
+def strength_tiles(course, balance_rules):
+    """
+    Split the course (phantoms included) into group_size tiers of n_groups
+    students each, weakest first by the balance rules' strengths.  Giving
+    each group one student from each tier starts the groups out balanced.
+    """
+    balance_rules = list(balance_rules)
+    min_strengths = strengthen_phantoms(course, balance_rules)
+
+    def strengths(s):
+        # sort students without a strength in with the weakest
+        key = []
+        for r, weakest in zip(balance_rules, min_strengths):
+            strength = r.get_strength(s)
+            key.append(weakest if strength is None else strength)
+        return key
 
     if len(course.students) != course.group_size * course.n_groups:
         raise InternalError("Students + Phantoms not divisible by groups")
 
     course.students.sort(key = strengths)
 
-    # randomly assort students into groups
-    mtiles = [course.students[course.n_groups*i:(course.n_groups*(i+1))]
-              for i in range(int(course.group_size))]
-
-    for mtile in mtiles:
-        random.shuffle(mtile)
-
-    groups = []
-    i = 0
-    while i < len(mtiles[0]):
-        # grab one student from each mtile
-        g = Group([mtile[i] for mtile in mtiles], i+1+group_number_offset)
-        groups.append(g)
-        i += 1
-
-    return groups
+    return [course.students[course.n_groups*i:(course.n_groups*(i+1))]
+            for i in range(int(course.group_size))]
@@ -20,9 +20,15 @@ from .utility import numberize
 from .errors import GroupEngFileError
 
 def read_input(infile):
+    """
+    Parse an input deck from a filename or an open file (or other object with
+    readlines, like io.StringIO)
+    """
     if not hasattr(infile, 'readlines'):
-        infile = open(infile)
+        with open(infile) as f:
+            return read_input(f)
 
+    name = getattr(infile, 'name', '<input deck>')
     lines = infile.readlines()
     lines = [l.strip() for l in lines if l.strip() != '' and l.strip()[0] != '#']
 
@@ -44,6 +50,26 @@ def read_input(infile):
             dek['number_of_groups'] = int(split_key(line)[1])
         elif re.match('tries', line):
             dek['tries'] = int(split_key(line)[1])
+        elif re.match('restarts', line):
+            dek['restarts'] = int(split_key(line)[1])
+        elif re.match('solver', line):
+            dek['solver'] = split_key(line)[1].lower()
+        elif re.match('initial', line):
+            dek['initial'] = split_key(line)[1].lower()
+        elif re.match('seed', line):
+            dek['seed'] = int(split_key(line)[1])
+        elif re.match('patience', line):
+            dek['patience'] = int(split_key(line)[1])
+        elif re.match('time_?limit', line):
+            dek['time_limit'] = float(split_key(line)[1])
+        elif re.match('cache_?class_?list', line):
+            dek['cache_classlist'] = yes(split_key(line)[1])
+        elif re.match('matrix_?engine', line):
+            dek['matrix_engine'] = yes(split_key(line)[1])
+        elif re.match('previous_groups', line):
+            dek['previous_groups'] = split_key(line)[1]
+        elif re.match('archive', line):
+            dek['archive'] = yes(split_key(line)[1])
         elif line[0] == '-':
             line = line[1:]
             # read a rule
@@ -65,7 +91,7 @@ def read_input(infile):
                 rule[key] = vals
             rules.append(rule)
         else:
-            raise GroupEngFileError(line, i+1, infile.name)
+            raise GroupEngFileError(line, i+1, name)
 
         i += 1
 
@@ -73,6 +99,9 @@ def read_input(infile):
 
     return dek
 
+def yes(st):
+    return st.lower() in ('yes', 'true', '1')
+
 def split_key(st):
     return [s.strip() for s in st.split(':')]
 
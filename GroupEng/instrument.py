@@ -0,0 +1,133 @@
+# Copyright 2011, Thomas G. Dimiduk
+#
+# This file is part of GroupEng.
+#
+# GroupEng is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# GroupEng is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with GroupEng.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Counters and timers for the solver's hot paths, broken out by rule.
+
+Each thread has its own current Stats so that simultaneous runs do not mix
+their numbers.  Work done while a rule is being applied (swap searches,
+retries, ...) is credited to that rule, rule checks are credited to the rule
+being checked.
+
+Nothing is collected unless a run asks for it (see collect).  Until then each
+thread's current Stats ignores everything, and the hottest paths (rule checks
+and swap validation) check the module's collecting count and skip timing
+altogether.
+
+.. moduleauthor:: Thomas G. Dimiduk tgd8@cornell.edu
+"""
+
+import json
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+_local = threading.local()
+_lock = threading.Lock()
+
+# number of threads currently collecting stats
+collecting = 0
+
+outside_rules = 'outside rules'
+
+def label(rule):
+    return '{0} {1}'.format(rule.name, rule.attribute)
+
+class Stats(object):
+    """
+    Call counts and cumulative seconds for named events, by rule
+    """
+    enabled = True
+
+    def __init__(self):
+        self.counts = defaultdict(Counter)
+        self.seconds = defaultdict(Counter)
+        # label of the rule currently being applied
+        self.rule = outside_rules
+
+    def count(self, name, rule=None, n=1):
+        if rule is None:
+            rule = self.rule
+        self.counts[rule][name] += n
+
+    def add_time(self, name, seconds, rule=None):
+        if rule is None:
+            rule = self.rule
+        self.seconds[rule][name] += seconds
+
+    def merge(self, other):
+        for rule, counts in other.counts.items():
+            self.counts[rule].update(counts)
+        for rule, seconds in other.seconds.items():
+            self.seconds[rule].update(seconds)
+        return self
+
+    def as_dict(self):
+        rules = sorted(set(self.counts).union(self.seconds))
+        return dict((rule, {'counts': dict(self.counts[rule]),
+                            'seconds': dict(self.seconds[rule])})
+                    for rule in rules)
+
+    def write_json(self, outf):
+        json.dump(self.as_dict(), outf, indent=2, sort_keys=True)
+
+    def __repr__(self):
+        return "Stats({0})".format(self.as_dict())
+
+class NoStats(Stats):
+    """
+    Stats that ignores everything, for runs that did not ask for stats
+    """
+    enabled = False
+
+    def count(self, name, rule=None, n=1):
+        pass
+
+    def add_time(self, name, seconds, rule=None):
+        pass
+
+def current():
+    """
+    Stats being collected by this thread
+    """
+    try:
+        return _local.stats
+    except AttributeError:
+        _local.stats = NoStats()
+        return _local.stats
+
+@contextmanager
+def collect(enabled=True):
+    """
+    Collect into a fresh Stats for this thread while in the with block
+
+    Yields the Stats, which is a NoStats if enabled is False.  The thread goes
+    back to what it was collecting into before afterwards.
+    """
+    global collecting
+    outer = current()
+    _local.stats = Stats() if enabled else NoStats()
+    if enabled:
+        with _lock:
+            collecting += 1
+    try:
+        yield _local.stats
+    finally:
+        if enabled:
+            with _lock:
+                collecting -= 1
+        _local.stats = outer
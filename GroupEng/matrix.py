@@ -0,0 +1,206 @@
+# Copyright 2011, Thomas G. Dimiduk
+#
+# This file is part of GroupEng.
+#
+# GroupEng is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# GroupEng is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with GroupEng.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Vectorized rule checking.  Encodes a class as integer coded categorical
+columns and float columns so that whether every group satisfies a rule can
+be computed at once with numpy instead of calling rule.check on each group.
+
+numpy is optional, check available before using this module.  The solver
+only uses it when an input deck asks for matrix_engine.
+
+.. moduleauthor:: Thomas G. Dimiduk tgd8@cornell.edu
+"""
+
+try:
+    import numpy as np
+    available = True
+except ImportError:
+    available = False
+
+from .rule import Aggregate, Balance, Cluster, NumberBased
+
+class NumpyNotAvailable(Exception):
+    def __str__(self):
+        return "The matrix engine requires numpy, which is not installed"
+
+class StudentMatrix(object):
+    """
+    Column oriented copy of a class list
+
+    Columns are encoded the first time a rule asks for them.  Categorical
+    columns store value codes with 0 reserved for missing (None) values,
+    numeric columns store floats with nan for missing values.
+    """
+
+    def __init__(self, students):
+        if not available:
+            raise NumpyNotAvailable()
+        self.students = list(students)
+        self.rows = dict((s, i) for i, s in enumerate(self.students))
+        self._categorical = {}
+        self._numeric = {}
+        # each student's group as a key into _keys, -1 for no group.  Kept
+        # up to date by refreshing only the groups that have changed since
+        # we last looked at them
+        self._assign = np.full(len(self.students), -1, dtype=np.intp)
+        self._keys = {}
+        self._seen = {}
+
+    def categorical(self, attribute):
+        try:
+            return self._categorical[attribute]
+        except KeyError:
+            codes = {None: 0}
+            column = np.empty(len(self.students), dtype=np.intp)
+            for i, s in enumerate(self.students):
+                column[i] = codes.setdefault(s[attribute], len(codes))
+            self._categorical[attribute] = column, codes
+            return column, codes
+
+    def numeric(self, attribute):
+        try:
+            return self._numeric[attribute]
+        except KeyError:
+            column = np.array([np.nan if s[attribute] is None else s[attribute]
+                               for s in self.students], dtype=float)
+            self._numeric[attribute] = column
+            return column
+
+    def assignment(self, groups):
+        """
+        Index into groups of each student's group, -1 for students in none of
+        them
+        """
+        for g in groups:
+            if self._seen.get(g) != g.changes:
+                self._refresh(g)
+        # position in groups of each group key, with a trailing -1 that
+        # students in no group (key -1) pick up
+        position = np.full(len(self._keys) + 1, -1, dtype=np.intp)
+        position[np.array([self._keys[g] for g in groups], dtype=np.intp)] = (
+            np.arange(len(groups)))
+        return position[self._assign]
+
+    def _refresh(self, group):
+        key = self._keys.setdefault(group, len(self._keys))
+        # students who have left went to groups that have changed too, or to
+        # no group at all
+        self._assign[self._assign == key] = -1
+        rows = np.array([self.rows[s] for s in group.students], dtype=np.intp)
+        self._assign[rows] = key
+        self._seen[group] = group.changes
+
+    def number(self, attribute, values, assign, n_groups):
+        """
+        Number of students in each group with the given attribute values
+        """
+        column, codes = self.categorical(attribute)
+        if not isinstance(values, (list, tuple)):
+            values = [values]
+        wanted = [codes[v] for v in values if v in codes]
+        mask = np.isin(column, wanted) & (assign >= 0)
+        return np.bincount(assign[mask], minlength=n_groups)
+
+    def check(self, rule, groups, assign=None):
+        """
+        Boolean array of whether each of groups satisfies rule
+        """
+        if assign is None:
+            assign = self.assignment(groups)
+        n_groups = len(groups)
+        attribute = rule.attribute
+
+        if isinstance(rule, Balance):
+            try:
+                values = self.numeric(attribute)
+            except (TypeError, ValueError):
+                # non numeric strengths, let the rule sort it out
+                return self._check_each(rule, groups)
+            has = ~np.isnan(values) & (assign >= 0)
+            sums = np.bincount(assign[has], weights=values[has],
+                               minlength=n_groups)
+            n = np.bincount(assign[has], minlength=n_groups)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                means = sums / n
+            # groups with no strengths at all fail, as in Balance._check
+            return (n > 0) & (np.abs(means - rule.mean) < rule.tol)
+
+        if isinstance(rule, Aggregate):
+            column, codes = self.categorical(attribute)
+            has = (column != 0) & (assign >= 0)
+            pairs = np.unique(assign[has] * len(codes) + column[has])
+            distinct = np.bincount(pairs // len(codes), minlength=n_groups)
+            return distinct == 1
+
+        if isinstance(rule, Cluster):
+            ok = np.ones(n_groups, dtype=bool)
+            for value in rule.values:
+                ok &= self.number(attribute, value, assign, n_groups) != 1
+            return ok
+
+        if isinstance(rule, NumberBased):
+            ok = np.ones(n_groups, dtype=bool)
+            for value in rule.values:
+                n = self.number(attribute, value, assign, n_groups)
+                ok &= np.isin(n, list(rule._target_numbers(value)))
+            return ok
+
+        return self._check_each(rule, groups)
+
+    def remember(self, rule, groups):
+        """
+        Check every group against rule at once and fill in each group's cache
+        of rule results
+        """
+        for group, ok in zip(groups, self.check(rule, groups)):
+            group.remember(rule, bool(ok))
+
+    def _check_each(self, rule, groups):
+        return np.array([bool(rule.check(g)) for g in groups], dtype=bool)
+
+def check_groups(rules, groups, students=None):
+    """
+    Check a complete grouping against every rule at once
+
+    Parameters
+    ----------
+    rules: list<Rule>
+        Rules to check
+    groups: list<Group>
+        Groups to check
+    students: list<Student> (optional)
+        Students to encode, defaults to everyone in groups
+
+    Returns
+    -------
+    verdicts: dict
+        rule -> boolean array of whether each group satisfies that rule
+    """
+    if students is None:
+        students = [s for g in groups for s in g.students]
+    matrix = StudentMatrix(students)
+    assign = matrix.assignment(groups)
+    return dict((rule, matrix.check(rule, groups, assign)) for rule in rules)
+
+def remember_checks(rules, groups):
+    """
+    Fill each group's cache of rule results from one vectorized pass
+    """
+    for rule, ok in check_groups(rules, groups).items():
+        for group, group_ok in zip(groups, ok):
+            group.remember(rule, bool(group_ok))
@@ -0,0 +1,294 @@
+# Copyright 2011, Thomas G. Dimiduk
+#
+# This file is part of GroupEng.
+#
+# GroupEng is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# GroupEng is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with GroupEng.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Incremental regrouping.  Starting from the groups of an earlier run (its
+classlist.csv output), fit in students who have added the class and close up
+after students who have dropped it while moving as few continuing students as
+possible.
+
+Only groups whose membership changed are repaired.  Rules are applied in
+priority order the way the solver applies them (aggregate and distribute
+rules place students among the changed groups first, then every rule's
+remedies fix what is left), and each swap has to keep the rules already
+applied for both groups, so groups that were not touched stay as they were
+unless a swap with them keeps their rules.  A leading aggregate rule splits the
+class just as it does for make_groups.
+
+.. moduleauthor:: Thomas G. Dimiduk tgd8@cornell.edu
+"""
+
+import logging
+import random
+from collections import Counter
+
+from . import instrument
+from .anneal import rule_weights
+from .controller import (EmptyClassList, Grouping, Solution, solver_options,
+                         split_class)
+from .course import Course, GroupSizer, sizer_from_dek
+from .feasibility import analyze
+from .group import Group, strengthen_phantoms
+from .rule import Aggregate, Balance, Distribute, make_rule
+from .student import column_converter, convert_cell, group_number, read_rows
+
+log = logging.getLogger('log')
+
+class NoGroupNumbers(Exception):
+    def __init__(self, filename):
+        self.filename = filename
+    def __str__(self):
+        return ("{0} has no {1} column, previous_groups should be the "
+                "classlist.csv output of an earlier GroupEng run".format(
+                    self.filename, group_number))
+
+def load_previous(filename, identifier=None):
+    """
+    Read the group each student was in from a classlist.csv output
+
+    Returns
+    -------
+    previous: dict
+        student identifier -> group number, both converted the way class list
+        cells are
+    """
+    rows = read_rows(filename)
+    headers = next(rows)
+    if group_number not in headers:
+        raise NoGroupNumbers(filename)
+    if identifier is None:
+        identifier = [h for h in headers if h != group_number][0]
+    i = headers.index(identifier)
+    j = headers.index(group_number)
+    convert = column_converter()
+    return dict((convert(row[i]), convert_cell(row[j])) for row in rows)
+
+def penalty(students, rules, weights):
+    return sum(weights[r] * r.violation(students) for r in rules)
+
+def number_key(n):
+    # group numbers read back from a class list are usually numbers, sort
+    # those numerically and anything else after them
+    if isinstance(n, (int, float)):
+        return 0, n, ''
+    return 1, 0, str(n)
+
+def regroup(dek, students, previous, collect_stats=False):
+    """
+    Fit a changed class list into an earlier grouping
+
+    Parameters
+    ----------
+    dek: dict
+        Parsed input deck
+    students: list<Student>
+        The current class list, left unchanged (as for make_groups)
+    previous: dict
+        student identifier -> group number from the earlier grouping, see
+        load_previous
+    collect_stats: bool
+        Count and time the work done by rule, see make_groups
+
+    Returns
+    -------
+    grouping: Grouping
+    """
+    if not students:
+        raise EmptyClassList()
+    students = [s.copy() for s in students]
+    identifier = students[0].identifier
+    options = solver_options(dek)
+    rng = random.Random(options['seed'])
+
+    subclasses, dek_rules = split_class(students, dek['rules'])
+    if subclasses is None:
+        subclasses = [students]
+
+    # each earlier group stays with the subclass most of its continuing
+    # students are in, anyone else from it counts as added
+    together = Counter((previous[s[identifier]], i)
+                       for i, subclass in enumerate(subclasses)
+                       for s in subclass if s[identifier] in previous)
+    owner = {}
+    for (n, i), count in sorted(together.items(), key=lambda x: -x[1]):
+        owner.setdefault(n, i)
+    numbers = sorted(set(previous.values()), key=number_key)
+    ints = [n for n in numbers if isinstance(n, int)]
+    next_number = max(ints) + 1 if ints else len(numbers) + 1
+    log.debug('Regrouping: {} continuing, {} added, {} dropped'.format(
+        sum(1 for s in students if s[identifier] in previous),
+        sum(1 for s in students if s[identifier] not in previous),
+        len(set(previous) - set(s[identifier] for s in students))))
+
+    solutions = []
+    moved = 0
+    with instrument.collect(collect_stats) as stats:
+        for i, subclass in enumerate(subclasses):
+            own = [n for n in numbers if owner.get(n) == i]
+            kept = dict((s[identifier], previous[s[identifier]])
+                        for s in subclass
+                        if owner.get(previous.get(s[identifier])) == i)
+            # how big each earlier group was, dropped students included
+            sizes = Counter(n for n in previous.values() if owner.get(n) == i)
+            solution, subclass_moved, next_number = regroup_subclass(
+                dek, dek_rules, subclass, kept, own, sizes, next_number,
+                options, rng)
+            solution.stats = stats
+            solutions.append(solution)
+            moved += subclass_moved
+    log.debug('Moved {} continuing students'.format(moved))
+
+    grouping = Grouping(solutions, identifier)
+    grouping.moved = moved
+    return grouping
+
+def regroup_subclass(dek, dek_rules, students, kept, numbers, sizes,
+                     next_number, options, rng):
+    """
+    Fit students into the earlier groups numbered numbers
+
+    kept maps the identifiers of students continuing in one of those groups
+    to its number, and sizes the numbers to how many students the groups had.
+    New groups are numbered from next_number.
+
+    Returns
+    -------
+    solution: Solution
+    moved: int
+        Number of students in kept who changed group
+    next_number: int
+        Number for the next new group
+    """
+    identifier = students[0].identifier
+    if numbers:
+        # keep every earlier group, only adding groups if the class has grown
+        # past what groups as big as the biggest earlier group can hold
+        biggest = max(sizes.values())
+        n_groups = len(numbers)
+        while -(-len(students) // n_groups) > biggest:
+            n_groups += 1
+    else:
+        # nothing to keep, size groups the way the deck asks
+        n_groups = sizer_from_dek(dek).n_groups(len(students))
+    course = Course(students, GroupSizer(None, n_groups=n_groups))
+    log.debug('Using {} groups of size {}'.format(course.n_groups,
+                                                  course.group_size))
+    phantoms = course.students[len(students):]
+
+    rules = [make_rule(r, course) for r in dek_rules]
+    problems = analyze(rules, course)
+    balance_rules = [r for r in rules if isinstance(r, Balance)]
+    # as weak as the weakest student, as when the solver deals groups
+    strengthen_phantoms(course, balance_rules)
+    weights = rule_weights(rules)
+
+    continuing = [s for s in students if s[identifier] in kept]
+    members = dict((n, []) for n in numbers)
+    for s in continuing:
+        members[kept[s[identifier]]].append(s)
+    numbers = list(numbers)
+    while len(members) < n_groups:
+        members[next_number] = []
+        numbers.append(next_number)
+        next_number += 1
+    before = dict((n, set(m)) for n, m in members.items())
+
+    # at most one phantom per group, in the groups with the most room
+    order = list(numbers)
+    rng.shuffle(order)
+    order.sort(key=lambda n: len(members[n]))
+    capacity = dict((n, course.group_size) for n in numbers)
+    for n in order[:len(phantoms)]:
+        capacity[n] -= 1
+
+    # groups left too big give up the students they miss least
+    to_place = [s for s in students if s[identifier] not in kept]
+    for n in numbers:
+        while len(members[n]) > capacity[n]:
+            leaving = min(members[n], key=lambda s: penalty(
+                [o for o in members[n] if o is not s], rules, weights))
+            members[n].remove(leaving)
+            to_place.append(leaving)
+
+    groups = [Group(members[n], n) for n in numbers]
+    open_slots = dict((g, capacity[g.group_number] - g.size) for g in groups)
+
+    # everyone else goes where they add the least penalty
+    rng.shuffle(to_place)
+    for s in to_place:
+        room = [g for g in groups if open_slots[g] > 0]
+        rng.shuffle(room)
+        best = min(room, key=lambda g: (
+            penalty(g.students + [s], rules, weights) -
+            penalty(g.students, rules, weights)))
+        best.add(s)
+        open_slots[best] -= 1
+    phantom_groups = [g for g in groups
+                      if capacity[g.group_number] < course.group_size]
+    for g, phantom in zip(phantom_groups, phantoms):
+        g.add(phantom)
+
+    rules = [Distribute(identifier, course, 'phantom')] + rules
+    repair(rules, before, groups, course.students, options['tries'], rng)
+
+    moved = sum(1 for s in continuing
+                if s.group.group_number != kept[s[identifier]])
+    suceeded = all(g.happy for g in groups)
+
+    for g in groups:
+        g.students = [s for s in g.students if s.data[identifier] != 'phantom']
+    course.students = [s for s in course.students
+                       if s.data[identifier] != 'phantom']
+
+    return (Solution(course, rules, balance_rules, groups, suceeded,
+                     problems=problems), moved, next_number)
+
+def repair(rules, before, groups, students, tries, rng=random):
+    """
+    Fix the changed groups rule by rule in priority order
+
+    Only groups whose students differ from before (group number -> set of
+    students) can have been broken by the adds and drops, or by the swaps
+    made for higher priority rules, so the rest never need looking at.  As
+    in apply_rule, aggregate and distribute rules first place students among
+    those groups, and every group is held to a rule once it has been applied.
+    """
+    def changed():
+        return [g for g in groups if set(g.students) != before[g.group_number]]
+
+    for rule in rules:
+        stats = instrument.current()
+        outer = stats.rule
+        stats.rule = instrument.label(rule)
+        try:
+            if isinstance(rule, (Aggregate, Distribute)):
+                rule.apply(changed(), students, rng)
+            for g in groups:
+                g.add_rule(rule)
+            failing = [g for g in changed() if not g.satisfies_rule(rule)]
+            for i in range(tries + 1):
+                if not failing:
+                    break
+                for g in failing:
+                    rule.remedy(g, groups, students, rng)
+                still = [g for g in failing if not g.satisfies_rule(rule)]
+                if len(still) == len(failing):
+                    # no progress, more passes will not help
+                    break
+                failing = still
+        finally:
+            stats.rule = outer
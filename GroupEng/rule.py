@@ -25,13 +25,15 @@ Grouping rules.  Definitions and functions for fixing groups.
 import logging
 import random
 import re
+import time
 from collections import Counter
-from operator import itemgetter
 from .student import attribute_match
 from .group import valid_swap, swap
 from . import utility
 from .group import Group
 from .errors import EmptyMean
+from . import instrument
+from .flow import place
 
 log = logging.getLogger('log')
 
@@ -56,11 +58,19 @@ def number(students, attribute, values):
     number: int
         Number of students with the given attribute falue
     """
-    # Handle input of a Group instead of a list of students
+    # Groups keep running counts of their attributes
     if isinstance(students, Group):
-        students = students.students
+        return students.number_with(attribute, values)
     return count_items(filter(attribute_match(attribute, values), students))
 
+def number_after_swap(group, attribute, values, leaving, joining):
+    """
+    Number of students with the given attribute values group would have if
+    student leaving were replaced by student joining
+    """
+    match = attribute_match(attribute, values)
+    return number(group, attribute, values) - match(leaving) + match(joining)
+
 class InvalidValues(Exception):
     def __init__(self, rule, attribute, bad_values = None):
         self.rule = rule
@@ -89,9 +99,14 @@ class Rule(object):
     """
     Base class for all grouping rules
     """
+    # set to False by feasibility.analyze for rules that can't be met by every
+    # group, for reporting (some groups may still meet them, so they are
+    # retried like any other rule)
+    feasible = True
 
     def __init__(self, attribute, course, values = 'all', weight = None, **kwargs):
         self.attribute = attribute
+        self.course = course
 
         if attribute not in course.students[0].headers:
             raise AttributeNotFound(self.name, attribute,
@@ -147,7 +162,11 @@ class Rule(object):
 
         # TODO add capability to collapse similar attributes
 
-        # weight ignored for now
+        # weight is only used by solvers that trade rules off against each
+        # other (see anneal), the greedy solver goes by rule order
+        if weight is not None:
+            weight = float(weight)
+        self.weight = weight
 
         self._init(attribute, course, values = 'all', weight = None, **kwargs)
 
@@ -166,28 +185,59 @@ class Rule(object):
             else:
                 return 0
 
-    def remedy(self, group, groups, students):
+    def remedy(self, group, groups, students, rng=random):
         # returns true if it managed to satisfy the rule without
         # breaking any others, returns false otherwise
         if group.happy:
             return True
-        random.shuffle(group.students)
+        rng.shuffle(group.students)
         for student in group.students:
-            self._fix(student, groups, students)
+            self._fix(student, groups, students, rng)
 
         return group.happy
 
 
     def check(self, students):
-        if isinstance(students, Group):
-            students = students.students
-        return self._check(students)
+        if not instrument.collecting:
+            return self._check(students)
+        stats = instrument.current()
+        name = instrument.label(self)
+        stats.count('check', name)
+        start = time.perf_counter()
+        # _check accepts either a Group or a plain collection of students, so
+        # hand Groups through to let rules use their cached counts
+        ok = self._check(students)
+        stats.add_time('check', time.perf_counter() - start, name)
+        return ok
 
-    def permissable_change(self, old, new):
-        # default to checking if the new Group works, some subclasses
-        # will instead look to see if we are making progress towards
-        # meeting the rule
-        return self.check(new) or not self.check(old)
+    def violation(self, students):
+        """
+        How badly students break the rule, 0 if they satisfy it.  Subclasses
+        give larger numbers for worse violations so solvers can tell when they
+        are getting closer.
+        """
+        if self.check(students):
+            return 0
+        return 1
+
+    def permissable_swap(self, group, leaving, joining):
+        """
+        Would it be acceptable for student leaving to be replaced in group by
+        student joining?  Yes if group would satisfy the rule afterwards or
+        does not satisfy it now, some subclasses instead look to see if we
+        are making progress towards meeting the rule.
+        """
+        return (self._check_swap(group, leaving, joining) or
+                not group.satisfies_rule(self))
+
+    def _check_swap(self, group, leaving, joining):
+        # Would group satisfy the rule after the swap?  Subclasses should
+        # override this to work from the group's cached state, this fallback
+        # builds the hypothetical group
+        new = set(group.students)
+        new.remove(leaving)
+        new.add(joining)
+        return self.check(new)
 
     def __str__(self):
         return "<{0} {1} {2}>".format(self.name, self.attribute, self.values)
@@ -204,7 +254,19 @@ class Cluster(Rule):
             ok = ok and number(students, self.attribute, value) != 1
         return ok
 
-    def _fix(self, student, groups, students):
+    def _check_swap(self, group, leaving, joining):
+        for value in self.values:
+            if number_after_swap(group, self.attribute, value, leaving,
+                                 joining) == 1:
+                return False
+        return True
+
+    def violation(self, students):
+        # number of isolated values
+        return sum(1 for value in self.values
+                   if number(students, self.attribute, value) == 1)
+
+    def _fix(self, student, groups, students, rng=random):
         success = True
         for value in self.values:
             if student[self.attribute] in self.values:
@@ -214,6 +276,8 @@ class Cluster(Rule):
                     return n > 0 and n < len(g.students)
                 def target_student(s):
                     return s[self.attribute] and s[self.attribute] not in value
+                # anyone outside value will do, no point in an index here
+                candidates = None
             else:
                 # we are not at the lone student, look to swap this for a
                 # student with attribute==values
@@ -222,11 +286,13 @@ class Cluster(Rule):
                     return n == 1 or n > 2
                 def target_student(s):
                     return s[self.attribute] and s[self.attribute] in value
+                candidates = self.course.students_with(self.attribute, value)
 
-            targets = filter(target_group, groups)
-            if count_items(targets) == 0:
+            targets = list(filter(target_group, groups))
+            if len(targets) == 0:
                 return False
-            success = (find_target_and_swap(student, targets, target_student)
+            success = (find_target_and_swap(student, targets, target_student,
+                                            candidates, rng)
                        and success)
 
         return success
@@ -246,24 +312,53 @@ class Balance(Rule):
 
     def get_strength(self, s):
         return s[self.attribute]
+    def group_mean(self, students):
+        # Groups keep a running sum of the attribute, use it when we can
+        if isinstance(students, Group):
+            return students.mean(self.attribute)
+        return utility.mean(students, self.get_strength)
     def __str__(self):
         return "<Balance : {0} : tol {1}>".format(self.mean, self.tol)
     def _check(self, students):
         try:
-            return abs(utility.mean(students, self.get_strength) - self.mean) < self.tol
+            return abs(self.group_mean(students) - self.mean) < self.tol
         # If somehow you don't have a strength for any of the students,
         # consider the group to be failing the rule
         except EmptyMean:
             return False
-    def permissable_change(self, old, new):
+    def violation(self, students):
+        # distance from the class mean in units of the tolerance
         try:
-            b = (abs(utility.mean(old, self.get_strength) - self.mean) >
-                 abs(utility.mean(new, self.get_strength) - self.mean))
+            deviation = abs(self.group_mean(students) - self.mean)
         except EmptyMean:
-            # If somehow one of the groups has nobody with a strength,
-            # allow swapping with that group
+            return 1
+        if deviation < self.tol:
+            return 0
+        if not self.tol:
+            return 1 + deviation
+        return deviation / self.tol
+
+    def permissable_swap(self, group, leaving, joining):
+        # Work out the new mean from the group's running sum and the two
+        # students' strengths rather than building the new group
+        total, n = group.total(self.attribute)
+        if n == 0:
+            # If somehow nobody in the group has a strength, allow swapping
+            # with that group
             return True
-        if self.check(new) and not b:
+        old = total/n
+        for s, sign in ((leaving, -1), (joining, 1)):
+            strength = self.get_strength(s)
+            if strength is not None:
+                total += sign*strength
+                n += sign
+        if n == 0:
+            return True
+        return self._judge(old, total/n)
+
+    def _judge(self, old_mean, new_mean):
+        b = abs(old_mean - self.mean) > abs(new_mean - self.mean)
+        if abs(new_mean - self.mean) < self.tol and not b:
             # return 2 here so that caller can distinquish if they
             # care that we have "worsened" but are still within
             # tolerance
@@ -271,33 +366,44 @@ class Balance(Rule):
         else:
             return b
 
-    def _fix(self, student, groups, students):
+    def _fix(self, student, groups, students, rng=random):
         group = student.group
-        if utility.mean(group, self.get_strength) - self.mean > 0:
+        try:
+            above = self.group_mean(group) - self.mean > 0
+        except EmptyMean:
+            # nobody in the group has a strength, bringing anyone in who does
+            # is a start
+            return find_target_and_swap(
+                student, groups, lambda s: self.get_strength(s) is not None,
+                rng=rng)
+        if above:
             def test(x):
                 try:
-                    return utility.mean(x, self.get_strength) < self.mean
+                    return self.group_mean(x) < self.mean
                 except EmptyMean:
                     return True
         else:
             def test(x):
                 try:
-                    return utility.mean(x, self.get_strength) > self.mean
+                    return self.group_mean(x) > self.mean
                 except EmptyMean:
                     return True
 
         targets = [g for g in groups if test(g)]
 
-        short_list = filter(lambda g: abs(utility.mean(g,
-                                                       self.get_strength) -
-                                          self.mean) > self.tol, targets)
+        def off_target(g):
+            try:
+                return abs(self.group_mean(g) - self.mean) > self.tol
+            except EmptyMean:
+                return True
+        short_list = [g for g in targets if off_target(g)]
 
         try:
-            if find_target_and_swap(student, short_list):
+            if find_target_and_swap(student, short_list, rng=rng):
                 return True
-            elif find_target_and_swap(student, targets):
+            elif find_target_and_swap(student, targets, rng=rng):
                 return True
-            elif find_target_and_swap(student, groups):
+            elif find_target_and_swap(student, groups, rng=rng):
                 return True
         except SwapButNotFix:
             return False
@@ -359,7 +465,22 @@ class NumberBased(Rule):
                 return False
         return True
 
-    def _fix(self, student, groups, students):
+    def _check_swap(self, group, leaving, joining):
+        for value in self.values:
+            if number_after_swap(group, self.attribute, value, leaving,
+                                 joining) not in self._target_numbers(value):
+                return False
+        return True
+
+    def violation(self, students):
+        # how many students away from an acceptable number for each value
+        total = 0
+        for value in self.values:
+            n = number(students, self.attribute, value)
+            total += min(abs(n - m) for m in self._target_numbers(value))
+        return total
+
+    def _fix(self, student, groups, students, rng=random):
         my_value = student[self.attribute]
         # check if my_value is the attribute value we are controlling for
         if self.numbers.get(my_value):
@@ -378,19 +499,25 @@ class NumberBased(Rule):
             # the other iterations of rule.remedy will try to bring one in.
             if not targets:
                 return False #raise NoTargets(self)
-            return find_target_and_swap(student, targets)
+            return find_target_and_swap(student, targets, rng=rng)
         return True
 
     def _target_numbers(self, value):
         raise NotImplemented()
 
     def count(self, l):
-        if hasattr(l, 'students'):
-            l = l.students
+        if isinstance(l, Group):
+            return Counter(l.counts(self.attribute))
         return Counter(s[self.attribute] for s in l)
 
 class Distribute(NumberBased):
     name = 'Distribute'
+    def apply(self, groups, students, rng=random):
+        rng.shuffle(groups)
+        # meet the target numbers directly where higher priority rules allow,
+        # see flow.py, leaving any stragglers to remedy
+        place(self, groups, rng)
+
     def _target_numbers(self, value):
         n = self.numbers[value]
         if n % self.n_groups == 0:
@@ -413,23 +540,52 @@ class Aggregate(NumberBased):
 
         return len(count.keys()) == 1
 
-    def apply(self, groups, students):
-        all_values = list(self.all_values)
-        random.shuffle(all_values)
+    def violation(self, students):
+        # number of extra values mixed into the group
+        count = self.count(students)
+        count.pop(None, 0)
+        if not count:
+            return 1
+        return len(count) - 1
+
+    def _check_swap(self, group, leaving, joining):
+        # track how many distinct (non None) values the group would have
+        count = group.counts(self.attribute)
+        distinct = len(count) - (None in count)
+        old = leaving[self.attribute]
+        new = joining[self.attribute]
+        if old != new:
+            if old is not None and count[old] == 1:
+                distinct -= 1
+            if new is not None and count[new] == 0:
+                distinct += 1
+        return distinct == 1
+
+    def apply(self, groups, students, rng=random):
+        # sort first so the order only depends on rng
+        all_values = sorted(self.all_values, key=str)
+        rng.shuffle(all_values)
         for value in all_values:
             def count(group):
                 return number(group, self.attribute, value)
 
-            go = sum(count(g) for g in groups)
-            while go:
-                groups = sorted(groups, key=count, reverse=True)
-                group = groups[0]
-                groups = groups[1:]
+            # groups not yet given a value, kept bucketed by how many students
+            # with this value they have rather than resorted after each swap
+            remaining = utility.Buckets(groups, count)
+            while remaining.total:
+                group = remaining.pop_largest()
                 group.add_rule(self)
-                for s in filter(self._is_not(value), group.students):
-                    targets = [g for g in groups if count(group)]
-                    find_target_and_swap(s, targets, self._is(value))
-                go = sum(count(g) for g in groups)
+                candidates = [s for s in
+                              self.course.students_with(self.attribute, value) +
+                              self.course.students_with(self.attribute, None)
+                              if s.group in remaining]
+                # swaps change group.students, so work from a copy
+                for s in list(filter(self._is_not(value), group.students)):
+                    if find_target_and_swap(s, remaining.counts,
+                                            self._is(value), candidates, rng):
+                        # s is now in the group it took a student from
+                        remaining.update(s.group)
+            groups = list(remaining)
 
     def _is(self, value):
         def match(s):
@@ -447,23 +603,62 @@ class Aggregate(NumberBased):
 
 
 
-class SwapButNotFix:
+class SwapButNotFix(Exception):
     def __init__(self, s1, s2):
         self.s1 = s1
         self.s2 = s2
 
-def find_target_and_swap(student, targets, target_student=lambda s: True):
-    target = find_swap_target(student, targets, target_student)
+def find_target_and_swap(student, targets, target_student=lambda s: True,
+                         candidates=None, rng=random):
+    if not instrument.collecting:
+        target = find_swap_target(student, targets, target_student,
+                                  candidates, rng)
+        if target:
+            swap(student, target)
+            return True
+        return False
+    stats = instrument.current()
+    start = time.perf_counter()
+    target = find_swap_target(student, targets, target_student, candidates,
+                              rng)
+    stats.add_time('find_target_and_swap', time.perf_counter() - start)
     if target:
+        stats.count('swaps')
         swap(student, target)
         return True
     else:
+        stats.count('failed_swaps')
         return False
 
-def find_swap_target(student, targets, target_student=lambda s: True):
-    random.shuffle(list(targets))
+def find_swap_target(student, targets, target_student=lambda s: True,
+                     candidates=None, rng=random):
+    """
+    Find a student in one of the target groups that student can be swapped
+    with without breaking rules.
+
+    If candidates (students who might satisfy target_student, usually from
+    Course.students_with) is given, only those students are considered, which
+    saves walking through every member of every target group.
+
+    rng (a random.Random or the random module) makes the random choices.
+    """
+    if candidates is not None:
+        if not isinstance(targets, (set, frozenset, dict)):
+            targets = set(targets)
+        # candidates may be the course's own index, shuffle a copy
+        candidates = list(candidates)
+        rng.shuffle(candidates)
+        for other in candidates:
+            if (other.group in targets and target_student(other) and
+                valid_swap(student, other)):
+                return other
+        return False
+
+    # targets may be an iterator, so shuffle a list of them once
+    targets = list(targets)
+    rng.shuffle(targets)
     for group in targets:
-        random.shuffle(group.students)
+        rng.shuffle(group.students)
         for other in group.students:
             if target_student(other) and valid_swap(student, other):
                 return other
@@ -477,44 +672,116 @@ def all_happy(groups):
     return True
 
 def all_satisfy_rule(groups, rule):
-    for group in groups:
-        if not group.satisfies_rule(rule):
-            print([s[rule.attribute] for s in group.students])
-            return False
-    return True
+    return count_failures(groups, rule) == 0
 
-def apply_rule(rule, groups, students, tries, mixing, try_number=0):
-    if isinstance(rule, Aggregate):
-        rule.apply(groups, students)
-    else:
-        random.shuffle(groups)
-    for group in groups:
-        # add rule checks and will not add the rule twice, so we can just do
-        # this
-        group.add_rule(rule)
-        if not group.satisfies_rule(rule):
-            rule.remedy(group, groups, students)
-
-    if not all_satisfy_rule(groups, rule):
-        if try_number < tries:
-            log.debug("Try {}/{} retrying for rule {}".format(try_number, tries, rule))
-            # Do a few random swaps (not allowing new rule breaks),
-            # just to mix things up a bit and increase the chances of
-            # finding new solutions
-            for i in range(int(mixing)):
-                find_target_and_swap(random.choice(students), groups)
-            return apply_rule(rule, groups, students, tries, mixing, try_number+1)
+def count_failures(groups, rule):
+    return sum(1 for group in groups if not group.satisfies_rule(rule))
+
+def apply_rule(rule, groups, students, tries, mixing=20, patience=None,
+               time_limit=None, rng=random, matrix=None):
+    """
+    Try to get every group to satisfy rule without breaking higher priority
+    rules
+
+    Parameters
+    ----------
+    rule: Rule
+        Rule to apply
+    groups: list<Group>
+        Groups to fix, modified in place
+    students: list<Student>
+        Everyone in groups
+    tries: int
+        Number of times to retry if some groups still fail the rule
+    mixing: int
+        Number of random swaps to make between retries
+    patience: int (optional)
+        Stop retrying after this many retries in a row that did not reduce the
+        number of failing groups
+    time_limit: float (optional)
+        Do not start another retry after this many seconds on the rule
+    rng: random.Random (optional)
+        Source of random choices, defaults to the random module
+    matrix: matrix.StudentMatrix (optional)
+        Check every group against the rule in one vectorized pass at the start
+        of each try instead of one group at a time
+
+    Returns
+    -------
+    success: bool
+        True if every group satisfies rule
+    """
+    # credit everything that happens while applying the rule to it
+    stats = instrument.current()
+    outer = stats.rule
+    stats.rule = instrument.label(rule)
+    start = time.perf_counter()
+    try:
+        return _apply_rule(rule, groups, students, tries, mixing, patience,
+                           time_limit, rng, stats, matrix)
+    finally:
+        stats.add_time('apply_rule', time.perf_counter() - start)
+        stats.rule = outer
+
+def _apply_rule(rule, groups, students, tries, mixing, patience, time_limit,
+                rng, stats, matrix):
+    start = time.time()
+    best = None
+    stale = 0
+    for try_number in range(tries + 1):
+        if isinstance(rule, (Aggregate, Distribute)):
+            rule.apply(groups, students, rng)
         else:
-            return False
-    else:
-        return True
+            rng.shuffle(groups)
+        if matrix is not None:
+            matrix.remember(rule, groups)
+        for group in groups:
+            # add rule checks and will not add the rule twice, so we can just
+            # do this
+            group.add_rule(rule)
+            if not group.satisfies_rule(rule):
+                rule.remedy(group, groups, students, rng)
+
+        failures = count_failures(groups, rule)
+        if failures == 0:
+            return True
+        if try_number == tries:
+            break
+
+        if best is None or failures < best:
+            best = failures
+            stale = 0
+        else:
+            stale += 1
+        if patience is not None and stale >= patience:
+            log.debug("No improvement in {} tries, giving up on rule {}".format(
+                stale, rule))
+            break
+        if time_limit is not None and time.time() - start > time_limit:
+            log.debug("Out of time after {} tries, giving up on rule {}".format(
+                try_number + 1, rule))
+            break
+
+        log.debug("Try {}/{} retrying for rule {}, {} groups failing".format(
+            try_number, tries, rule, failures))
+        stats.count('retries')
+        # Do a few random swaps (not allowing new rule breaks),
+        # just to mix things up a bit and increase the chances of
+        # finding new solutions
+        for i in range(int(mixing)):
+            if find_target_and_swap(rng.choice(students), groups, rng=rng):
+                stats.count('mixing_swaps')
+
+    return False
 
 
 
-def apply_rules_list(rules, groups, students, tries, mixing=20):
+def apply_rules_list(rules, groups, students, tries, mixing=20, patience=None,
+                     time_limit=None, rng=random, matrix=None):
     success = True
     for rule in rules:
-        success = apply_rule(rule, groups, students, tries, mixing) and success
+        success = apply_rule(rule, groups, students, tries, mixing, patience,
+                             time_limit, rng, matrix) and success
     return success
 
 
@@ -0,0 +1,227 @@
+# Copyright 2011, Thomas G. Dimiduk
+#
+# This file is part of GroupEng.
+#
+# GroupEng is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# GroupEng is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with GroupEng.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Grouping service.  Keeps a pool of worker processes running and makes groups
+for input decks and class lists sent to it over HTTP, so a burst of small
+jobs does not pay for starting python and importing GroupEng every time.
+
+Requests and responses are json.  A job is
+
+    {"deck": <input deck text>, "classlist": <csv text>, "files": <bool>,
+     "previous": <csv text>}
+
+where the deck's classlist line (if any) is ignored and files asks for the
+text of the usual output files in the result.  previous is optional, it is the
+classlist.csv output of an earlier grouping to fit the class list into (see
+regroup.py).  The server does not read files, so a deck's previous_groups
+line is an error.
+
+POST /jobs
+    Queue a job, responds with {"id": <job id>}
+GET /jobs/<id>
+    {"status": "queued" | "running" | "done" | "failed"} along with
+    "result" (see Grouping.as_dict) when done or "error" when failed
+POST /group
+    Run a job and wait for it, responds with its result (or {"error": ...})
+
+.. moduleauthor:: Thomas G. Dimiduk tgd8@cornell.edu
+"""
+
+import io
+import json
+import logging
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, wait
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from . import input_parser
+from .controller import OutputMemory, make_groups, rule_columns
+from .regroup import load_previous, regroup
+from .student import load_classlist
+
+log = logging.getLogger('log')
+
+def group_job(deck, classlist, files=False, previous=None):
+    """
+    Make groups for an input deck and class list given as text
+
+    Runs in a worker process, so restarts are solved one after another rather
+    than in yet more processes.
+    """
+    dek = input_parser.read_input(io.StringIO(deck))
+    if dek.get('previous_groups'):
+        raise BadJob('send the earlier classlist.csv as "previous" rather '
+                     'than naming a file with previous_groups')
+    students = load_classlist(io.StringIO(classlist),
+                              dek.get('student_identifier'), rule_columns(dek))
+    if previous is not None:
+        identifier = students[0].identifier if students else None
+        grouping = regroup(dek, students, load_previous(io.StringIO(previous),
+                                                        identifier))
+    else:
+        grouping = make_groups(dek, students, parallel=False)
+    result = grouping.as_dict()
+    if files:
+        out = OutputMemory('groups')
+        grouping.write(out, 'deck', 'classlist')
+        result['files'] = out.files
+    return result
+
+class BadJob(Exception):
+    pass
+
+class Service(object):
+    """
+    Queue of grouping jobs run on a pool of worker processes
+
+    Parameters
+    ----------
+    workers: int (optional)
+        Number of worker processes, defaults to the number of cpus
+    keep: int
+        Number of finished jobs to remember results for
+    """
+    def __init__(self, workers=None, keep=1000):
+        self.workers = workers or os.cpu_count() or 1
+        self.keep = keep
+        self.pool = ProcessPoolExecutor(self.workers)
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+
+    def warm(self):
+        """
+        Start all of the worker processes now rather than on the first jobs
+        """
+        wait([self.pool.submit(os.getpid) for i in range(self.workers)])
+
+    def submit(self, job):
+        try:
+            args = (job['deck'], job['classlist'], bool(job.get('files')),
+                    job.get('previous'))
+        except (KeyError, TypeError):
+            raise BadJob('a job needs a deck and a classlist')
+        future = self.pool.submit(group_job, *args)
+        job_id = uuid.uuid4().hex
+        with self.lock:
+            self.jobs[job_id] = future
+            self._forget_old()
+        return job_id, future
+
+    def _forget_old(self):
+        finished = [i for i, f in self.jobs.items() if f.done()]
+        for i in finished[:max(0, len(finished) - self.keep)]:
+            del self.jobs[i]
+
+    def status(self, job_id):
+        """
+        Status of a job as a dict, or None for unknown jobs
+        """
+        with self.lock:
+            future = self.jobs.get(job_id)
+        if future is None:
+            return None
+        return describe(future)
+
+    def close(self):
+        self.pool.shutdown()
+
+def describe(future):
+    if future.running():
+        return {'status': 'running'}
+    if not future.done():
+        return {'status': 'queued'}
+    e = future.exception()
+    if e is not None:
+        return {'status': 'failed', 'error': str(e)}
+    return {'status': 'done', 'result': future.result()}
+
+class Handler(BaseHTTPRequestHandler):
+    # the service is attached to the server, see make_server
+    max_body = 64 * 1024 * 1024
+
+    def send_json(self, code, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_job(self):
+        length = int(self.headers.get('Content-Length', 0))
+        if length > self.max_body:
+            raise BadJob('job is too large')
+        try:
+            return json.loads(self.rfile.read(length).decode('utf-8'))
+        except ValueError:
+            raise BadJob('job is not valid json')
+
+    def do_POST(self):
+        service = self.server.service
+        try:
+            if self.path == '/jobs':
+                job_id, future = service.submit(self.read_job())
+                self.send_json(202, {'id': job_id})
+            elif self.path == '/group':
+                job_id, future = service.submit(self.read_job())
+                wait([future])
+                status = describe(future)
+                if status['status'] == 'done':
+                    self.send_json(200, status['result'])
+                else:
+                    self.send_json(400, {'error': status['error']})
+            else:
+                self.send_json(404, {'error': 'unknown path'})
+        except BadJob as e:
+            self.send_json(400, {'error': str(e)})
+
+    def do_GET(self):
+        if self.path.startswith('/jobs/'):
+            status = self.server.service.status(self.path[len('/jobs/'):])
+            if status is None:
+                self.send_json(404, {'error': 'unknown job'})
+            else:
+                self.send_json(200, status)
+        else:
+            self.send_json(404, {'error': 'unknown path'})
+
+    def log_message(self, format, *args):
+        log.debug('server: ' + format % args)
+
+def make_server(host='127.0.0.1', port=8080, workers=None):
+    """
+    Make a grouping server with warm workers, call serve_forever to run it
+    """
+    service = Service(workers)
+    service.warm()
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.service = service
+    return server
+
+def serve(host='127.0.0.1', port=8080, workers=None):
+    server = make_server(host, port, workers)
+    log.debug('Serving on {}:{} with {} workers'.format(
+        host, server.server_address[1], server.service.workers))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        server.service.close()
@@ -22,40 +22,163 @@ Student record.  Creating Student record from a csv (excel) file.
 """
 from .utility import numberize
 
+import copy
 import csv
+try:
+    from collections.abc import Mapping, MutableMapping
+except ImportError:
+    from collections import Mapping, MutableMapping
 
 group_number = 'Group Number'
 
+def convert_cell(val):
+    """
+    Turn a value from a class list into what GroupEng stores: blanks (and 0)
+    become None, numbers become numbers.
+    """
+    if val in ['', '0']:
+        return None
+    return numberize(val)
 
+class Schema(object):
+    """
+    Column layout shared by all of the students in a class list
+
+    Loaded columns are converted when read and are what the rules work with.
+    Any other columns are only passed through to the output, so students keep
+    them as the raw strings from the file and convert them on request.
+    """
+    def __init__(self, headers, identifier=None, loaded=None):
+        self.columns = [h for h in headers if h != group_number]
+        self.identifier = identifier
+        if identifier == None:
+            # if they don't give us an identifier, just use the first column
+            self.identifier = self.columns[0]
+        if loaded is None:
+            self.loaded = list(self.columns)
+        else:
+            loaded = set(loaded)
+            loaded.add(self.identifier)
+            self.loaded = [h for h in self.columns if h in loaded]
+        self.passthrough = [h for h in self.columns if h not in self.loaded]
+        self.index = dict((h, i) for i, h in enumerate(self.loaded))
+        self.passthrough_index = dict((h, i) for i, h in
+                                      enumerate(self.passthrough))
+        self.headers = list(self.columns) + [group_number]
+        # column -> schema with that column added, see with_column
+        self._extended = {}
+
+    def with_column(self, column):
+        """
+        A copy of the schema with a loaded column that was not in the class
+        list
+
+        Schemas are shared by students and the copies of them each run makes,
+        so they are never changed in place.  Asking again for the same column
+        gives the same copy.  The column is not one of the output headers.
+        """
+        try:
+            return self._extended[column]
+        except KeyError:
+            pass
+        schema = copy.copy(self)
+        schema.columns = self.columns + [column]
+        schema.loaded = self.loaded + [column]
+        schema.index = dict(self.index)
+        schema.index[column] = len(self.loaded)
+        schema._extended = {}
+        self._extended[column] = schema
+        return schema
+
+    def __repr__(self):
+        return "Schema(headers={0}, identifier={1})".format(self.columns,
+                                                          self.identifier)
+
+class StudentData(MutableMapping):
+    """
+    dict like view of a student's values, keyed by column name
+    """
+    __slots__ = ['student']
+
+    def __init__(self, student):
+        self.student = student
+
+    def __getitem__(self, key):
+        return self.student[key]
+
+    def __setitem__(self, key, value):
+        schema = self.student.schema
+        if key in schema.passthrough_index:
+            raise KeyError("{0} is not a loaded column".format(key))
+        if key not in schema.index:
+            schema = self.student.schema = schema.with_column(key)
+        values = self.student.values
+        i = schema.index[key]
+        if i >= len(values):
+            values.extend([None] * (i + 1 - len(values)))
+        values[i] = value
+
+    def __delitem__(self, key):
+        raise TypeError("Can't remove a column from one student")
+
+    def __iter__(self):
+        return iter(self.student.schema.columns)
+
+    def __len__(self):
+        return len(self.student.schema.columns)
 
 class Student(object):
     """
+    A student's values for each column of the class list, stored compactly
+
+    Students loaded together share one Schema, so each student only holds a
+    list of its values, raw strings for any passthrough columns and its
+    current group.
     """
+    __slots__ = ['schema', 'values', 'passthrough', 'group']
 
-    def __init__(self, data = {}, headers = [], identifier=None):
+    def __init__(self, data = {}, headers = [], identifier=None, schema=None,
+                 values=None, passthrough=None):
         """
 
         Arguments:
-        :param attributes:
-        :type attributes:
+        :param data: column -> value (converted with convert_cell)
+        :type data: dict
+        :param headers: column names, the first is the default identifier
+        :type headers: list
+        :param schema: shared column layout, use with values instead of data
+            and headers
+        :type schema: Schema
+        :param values: already converted values for the schema's loaded
+            columns
+        :type values: list
+        :param passthrough: unconverted strings for the schema's passthrough
+            columns
+        :type passthrough: tuple
 
         """
-        self.identifier = identifier
-        if identifier == None:
-            # if they don't give us an identifier, just use the first column
-            self.identifier = headers[0]
+        if schema is None:
+            headers = list(headers) + [k for k in data if k not in headers]
+            schema = Schema(headers, identifier)
+            values = [convert_cell(data.get(h)) for h in schema.columns]
+        if passthrough is None:
+            passthrough = ('',) * len(schema.passthrough)
+        self.schema = schema
+        self.values = values
+        self.passthrough = passthrough
+        self.group = None
 
-        self.data = data
-        for key, val in self.data.items():
-            if val in ['', '0']:
-                self.data[key] = None
-            else:
-                self.data[key] = numberize(val)
+    @property
+    def identifier(self):
+        return self.schema.identifier
 
-        self.group = None
-        self.headers = list(headers)
-        if group_number not in self.headers:
-            self.headers.append(group_number)
+    @property
+    def headers(self):
+        return self.schema.headers
+
+    @property
+    def data(self):
+        return StudentData(self)
 
     @property
     def group_number(self):
@@ -64,18 +187,34 @@ class Student(object):
     def __getitem__(self, x):
         if x == group_number:
             return self.group.group_number
-        else:
-            return self.data[x]
+        try:
+            i = self.schema.index[x]
+        except KeyError:
+            if x not in self.schema.passthrough_index:
+                raise
+            return convert_cell(self.passthrough[
+                self.schema.passthrough_index[x]])
+        if i >= len(self.values):
+            # a column added after this student was made
+            return None
+        return self.values[i]
     def __str__(self):
-        return "<Student : {0}>".format(self.data)
+        return "<Student : {0}>".format(dict(self.data))
 
     def __repr__(self):
         return "Student(data={0}, headers={1}, identifier={2})".format(
-            self.data, self.headers, self.identifier)
+            dict(self.data), self.headers, self.identifier)
 
     def full_record(self):
         return [str(self[h]) for h in self.headers]
 
+    def copy(self):
+        """
+        A new student with the same values and schema, not in any group
+        """
+        return Student(schema=self.schema, values=list(self.values),
+                       passthrough=self.passthrough)
+
 def attribute_match(attribute, value):
     if isinstance(value, (list, tuple)):
         return lambda x: x[attribute] in value
@@ -86,29 +225,117 @@ def attribute_differs(attribute, value):
     return lambda x: x[attribute] != value
 
 
-def load_classlist(filename, identifier):
-    inf = csv.reader(open(filename))
+def read_rows(filename):
+    """
+    Read a csv class list from a filename or open file
 
-    # csv api changed in python3, be compatible with both
-    try:
-        header_line = inf.__next__()
-    except AttributeError:
-        header_line = inf.next()
+    Yields the header names first, then each non blank row as a list of
+    stripped cells, one for each header.
+    """
+    if hasattr(filename, 'read'):
+        yield from _read_rows(filename)
+    else:
+        with open(filename, newline='') as f:
+            yield from _read_rows(f)
 
-    # Strip excess spaces from the header names, since this can lead to tricky
-    # bugs later
+def _read_rows(f):
+    inf = csv.reader(f)
+    header_line = next(inf)
+
+    # Strip excess spaces from the header names, since this can lead to
+    # tricky bugs later
     headers = [h.strip() for h in header_line if h.strip() != '']
-    # now make the students from the file
-    students = []
+    yield headers
+
     for s in inf:
         if set(s).issubset(set(['', ' ', None])):
             # skip blank lines
             pass
         else:
-            d = {}
-            for i, h  in enumerate(headers):
-                d[h] = s[i].strip()
-            # make a copy of headers so Student doesn't change it
-            students.append(Student(d, list(headers), identifier))
+            yield [s[i].strip() for i in range(len(headers))]
+
+def load_classlist(filename, identifier, columns=None):
+    """
+    Read students from a csv file (a filename or open file)
+
+    Rows are turned into Students as they are read.  Cells are converted once
+    per distinct value in each column (class lists repeat the same few values
+    a lot), and every student shares the header Schema.
+
+    If columns is given, only those columns (and the identifier) are
+    converted, the rest are kept as strings for output.
+    """
+    rows = read_rows(filename)
+    headers = next(rows)
+    return make_students(headers, rows, identifier, columns)
+
+def students_from_table(rows, identifier=None, columns=None, headers=None):
+    """
+    Make students from a table already in memory
+
+    Parameters
+    ----------
+    rows: list<dict> or list<list>
+        One row per student, either mappings of column name to value or
+        sequences of values in the order of headers
+    identifier: string (optional)
+        Student identifier column, defaults to the first column
+    columns: list<string> (optional)
+        Columns to convert, as for load_classlist
+    headers: list<string> (optional)
+        Column names, defaults to the keys of the first row
+
+    Cells are treated as if they had been read from a csv file, so 3.5 and
+    '3.5' give the same student.
+    """
+    rows = list(rows)
+    if headers is None:
+        headers = list(rows[0].keys())
+    headers = [h.strip() for h in headers]
+
+    def cell(v):
+        if v is None:
+            return ''
+        return str(v).strip()
+
+    if rows and isinstance(rows[0], Mapping):
+        rows = [[cell(row.get(h)) for h in headers] for row in rows]
+    else:
+        rows = [[cell(v) for v in row] for row in rows]
+    return make_students(headers, rows, identifier, columns)
+
+def make_students(headers, rows, identifier=None, columns=None):
+    """
+    Make students sharing one Schema from rows of strings
+    """
+    schema = Schema(headers, identifier, columns)
+    converters = [(i, column_converter()) for i, h in enumerate(headers)
+                  if h in schema.index]
+    passthrough = [i for i, h in enumerate(headers)
+                   if h in schema.passthrough_index]
+
+    students = []
+    for row in rows:
+        values = [convert(row[i]) for i, convert in converters]
+        extra = tuple(row[i] for i in passthrough)
+        students.append(Student(schema=schema, values=values,
+                                passthrough=extra))
 
     return students
+
+def column_converter(limit=10000):
+    """
+    convert_cell with a cache, for converting the cells of one column.  Stops
+    caching new values after limit distinct values so columns of unique
+    values (ids, names) do not hold on to a second copy of everything.
+    """
+    cache = {}
+    def convert(cell):
+        try:
+            return cache[cell]
+        except KeyError:
+            value = convert_cell(cell)
+            if len(cache) < limit:
+                cache[cell] = value
+            return value
+    return convert
@@ -16,6 +16,7 @@
 # along with GroupEng.  If not, see <http://www.gnu.org/licenses/>.
 
 import math
+from collections import defaultdict
 from .errors import EmptyMean
 
 def mean(l, key = lambda x: x):
@@ -58,3 +59,66 @@ def numberize(n):
                 return n
     except TypeError:
         return n
+
+
+class Buckets(object):
+    """
+    Items kept in buckets by a count, so the item with the largest count can
+    be found without sorting
+
+    Parameters
+    ----------
+    items: iterable
+        Items to bucket, in the order ties should be broken
+    count: function
+        Non negative integer count for an item, called again by update
+    """
+    def __init__(self, items, count):
+        self.count = count
+        # item -> its count, also the set of items
+        self.counts = {}
+        # count -> {item: None}, dicts so ties come out in a repeatable order
+        self.buckets = defaultdict(dict)
+        self.total = 0
+        self.top = 0
+        for item in items:
+            self._add(item, count(item))
+
+    def _add(self, item, n):
+        self.counts[item] = n
+        self.buckets[n][item] = None
+        self.total += n
+        self.top = max(self.top, n)
+
+    def _remove(self, item):
+        n = self.counts.pop(item)
+        del self.buckets[n][item]
+        self.total -= n
+
+    def __contains__(self, item):
+        return item in self.counts
+
+    def __iter__(self):
+        return iter(self.counts)
+
+    def __len__(self):
+        return len(self.counts)
+
+    def pop_largest(self):
+        """
+        Remove and return the item with the largest count (the one that has
+        had it longest if several tie)
+        """
+        while not self.buckets[self.top]:
+            self.top -= 1
+        item = next(iter(self.buckets[self.top]))
+        self._remove(item)
+        return item
+
+    def update(self, item):
+        """
+        Recount an item whose count may have changed
+        """
+        if item in self.counts:
+            self._remove(item)
+            self._add(item, self.count(item))
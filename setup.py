@@ -15,4 +15,7 @@ setuptools.setup(
     license='GNU Affero General Public License v3.0',
     packages=['GroupEng'],
     install_requires=[''],
+    # numpy is only needed for the matrix_engine option, the tests use it to
+    # check that engine against the plain one
+    extras_require={'matrix': ['numpy'], 'test': ['pytest', 'numpy']},
 )
@@ -0,0 +1,27 @@
+import pytest
+
+from GroupEng.course import Course, GroupSizer
+from GroupEng.group import Group
+from GroupEng.student import students_from_table
+
+
+@pytest.fixture
+def course_from_rows():
+    """
+    Make a Course from a list of dicts keyed by column name, identified by ID
+    """
+    def make(rows, size='4+'):
+        return Course(students_from_table(rows, 'ID'), GroupSizer(size))
+    return make
+
+
+@pytest.fixture
+def groups_in_order():
+    """
+    Put a course's students into groups of size in class list order
+    """
+    def make(course, size=4):
+        students = list(course.students)
+        return [Group(students[i:i+size], i // size + 1)
+                for i in range(0, len(students), size)]
+    return make
@@ -0,0 +1,25 @@
+import random
+
+from GroupEng.rule import Aggregate
+from GroupEng.utility import Buckets
+
+
+def test_buckets():
+    counts = {'a': 2, 'b': 5, 'c': 5, 'd': 0}
+    buckets = Buckets('abcd', counts.get)
+    assert buckets.total == 12
+    assert buckets.pop_largest() == 'b'
+    counts['a'] = 7
+    buckets.update('a')
+    assert [buckets.pop_largest() for i in range(3)] == ['a', 'c', 'd']
+    assert buckets.total == 0 and len(buckets) == 0
+
+
+def test_apply_packs_projects(course_from_rows, groups_in_order):
+    # four students on each project, dealt out so every group starts mixed
+    rows = [{'ID': i, 'Project': 'p{}'.format(i % 6)} for i in range(1, 25)]
+    course = course_from_rows(rows)
+    groups = groups_in_order(course)
+    rule = Aggregate('Project', course)
+    rule.apply(groups, course.students, random.Random(1))
+    assert all(rule.check(g) for g in groups)
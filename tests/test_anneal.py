@@ -0,0 +1,24 @@
+import io
+import random
+
+import GroupEng
+from GroupEng.anneal import anneal
+from GroupEng.group import Group
+from GroupEng.rule import Balance
+
+
+def test_one_group(course_from_rows):
+    rows = [{'ID': i, 'GPA': 2.0 + i / 4.} for i in range(1, 5)]
+    course = course_from_rows(rows)
+    groups = [Group(list(course.students), 1)]
+    rule = Balance('GPA', course)
+    assert anneal([rule], groups, course.students, rng=random.Random(1))
+
+
+def test_one_group_from_deck():
+    deck = 'group_size : 4+\nseed : 1\nsolver : anneal\n- balance : GPA\n'
+    students = GroupEng.students_from_table(
+        [{'ID': i, 'GPA': 2.0 + i / 4.} for i in range(1, 5)], 'ID')
+    grouping = GroupEng.make_groups(GroupEng.read_input(io.StringIO(deck)),
+                                    students, parallel=False)
+    assert len(grouping.groups) == 1
@@ -0,0 +1,99 @@
+import io
+import os
+
+import pytest
+
+import GroupEng
+from GroupEng import matrix
+from GroupEng.controller import EmptyClassList
+
+
+deck = """group_size : 3+
+seed : 1
+- cluster : Gender
+  values : F
+- balance : GPA
+"""
+
+
+def table():
+    genders = 'FMMFMMFMMFMM'
+    return [{'ID': str(i + 1), 'Gender': g, 'GPA': 2 + (i % 5) / 2.}
+            for i, g in enumerate(genders)]
+
+
+def test_make_groups_in_memory():
+    cwd = os.getcwd()
+    students = GroupEng.students_from_table(table(), 'ID')
+    before = list(students)
+    grouping = GroupEng.make_groups(GroupEng.read_input(io.StringIO(deck)),
+                                    students)
+    assert os.getcwd() == cwd
+    assert sorted(s['ID'] for g in grouping.groups for s in g.students) == \
+        list(range(1, 13))
+    assert [s.group for s in grouping.students] == \
+        sorted((s.group for s in grouping.students),
+               key=grouping.groups.index)
+    assert len(grouping.failures()) == 2
+    # the caller's students are left as they were
+    assert students == before
+    assert all(s.group is None for s in students)
+
+
+def test_make_groups_leaves_input_alone():
+    # 11 students in groups of 4- takes a phantom
+    students = GroupEng.students_from_table(table()[:11], 'ID')
+    before = list(students)
+    dek = GroupEng.read_input(io.StringIO(deck.replace('3+', '4-')))
+    GroupEng.make_groups(dek, students)
+    assert students == before
+    assert all(s.group is None for s in students)
+
+
+def test_make_groups_empty_class():
+    dek = GroupEng.read_input(io.StringIO(deck))
+    with pytest.raises(EmptyClassList):
+        GroupEng.make_groups(dek, [])
+
+
+def test_students_from_table_matches_csv(tmpdir):
+    classlist = str(tmpdir.join('class.csv'))
+    with open(classlist, 'w') as f:
+        f.write('ID,Gender,GPA\n')
+        for row in table():
+            f.write('{ID},{Gender},{GPA}\n'.format(**row))
+    from_csv = GroupEng.load_classlist(classlist, 'ID')
+    from_table = GroupEng.students_from_table(table(), 'ID')
+    assert [dict(s.data) for s in from_csv] == \
+        [dict(s.data) for s in from_table]
+
+
+def test_stats_only_when_asked_for():
+    dek = GroupEng.read_input(io.StringIO(deck))
+    students = GroupEng.students_from_table(table(), 'ID')
+    assert GroupEng.make_groups(dek, students).stats.as_dict() == {}
+    stats = GroupEng.make_groups(dek, students, collect_stats=True).stats
+    assert sum(r['counts'].get('check', 0)
+               for r in stats.as_dict().values()) > 0
+
+
+@pytest.mark.skipif(matrix.available, reason='numpy is installed')
+def test_matrix_engine_needs_numpy():
+    dek = GroupEng.read_input(io.StringIO('matrix_engine : yes\n' + deck))
+    with pytest.raises(matrix.NumpyNotAvailable):
+        GroupEng.make_groups(dek, GroupEng.students_from_table(table(), 'ID'))
+
+
+@pytest.mark.parametrize('solver', ['greedy', 'anneal'])
+def test_same_seed_same_groups(solver):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    dek = GroupEng.read_input(
+        os.path.join(root, 'sample_group_specification.groupeng'))
+    dek.update(seed=5, solver=solver, restarts=2)
+    students = GroupEng.load_classlist(os.path.join(root, dek['classlist']),
+                                       dek.get('student_identifier'))
+    runs = [[[s['ID'] for s in g.students]
+             for g in GroupEng.make_groups(dek, students,
+                                           parallel=False).groups]
+            for i in range(2)]
+    assert runs[0] == runs[1]
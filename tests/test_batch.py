@@ -0,0 +1,54 @@
+import os
+
+from GroupEng import batch
+from GroupEng.cache import cache_filename
+
+
+def test_batch_shares_classlist(tmpdir):
+    with open(str(tmpdir.join('class.csv')), 'w') as f:
+        f.write('ID,GPA\n')
+        for i in range(12):
+            f.write('{0},{1}\n'.format(i + 1, 2 + (i % 5) / 2.))
+    for name, size, cache in [('threes', '3+', 'no'), ('fours', '4+', 'yes')]:
+        with open(str(tmpdir.join(name + '.groupeng')), 'w') as f:
+            f.write('classlist : class.csv\ngroup_size : {0}\nseed : 1\n'
+                    'cache_classlist : {1}\n- balance : GPA\n'.format(
+                        size, cache))
+    with open(str(tmpdir.join('broken.groupeng')), 'w') as f:
+        f.write('nonsense\n')
+
+    summary = str(tmpdir.join('summary.csv'))
+    results, summary = batch.run_batch([str(tmpdir)], workers=1,
+                                       summary=summary)
+    assert [os.path.basename(r.deck) for r in results] == \
+        ['broken.groupeng', 'fours.groupeng', 'threes.groupeng']
+    assert results[0].status == 'error'
+    assert [r.n_groups for r in results[1:]] == [3, 4]
+    assert all(os.path.isdir(r.output) for r in results[1:])
+    assert batch.counts(results)['error'] == 1
+    assert os.path.exists(summary)
+    # read once, through the cache one of the decks asked for
+    assert os.path.exists(cache_filename(str(tmpdir.join('class.csv'))))
+
+
+def test_batch_regroups(tmpdir):
+    with open(str(tmpdir.join('class.csv')), 'w') as f:
+        f.write('ID,GPA\n')
+        for i in range(12):
+            f.write('{0},{1}\n'.format(i + 1, 2 + (i % 5) / 2.))
+    with open(str(tmpdir.join('earlier.csv')), 'w') as f:
+        f.write('ID,GPA,Group Number\n')
+        for i in range(12):
+            f.write('{0},{1},{2}\n'.format(i + 1, 2 + (i % 5) / 2., 7 + i % 3))
+    with open(str(tmpdir.join('again.groupeng')), 'w') as f:
+        f.write('classlist : class.csv\nprevious_groups : earlier.csv\n'
+                'group_size : 4+\nseed : 1\n- balance : GPA\n')
+
+    results, summary = batch.run_batch([str(tmpdir)], workers=1,
+                                       summary=str(tmpdir.join('summary.csv')))
+    assert results[0].status != 'error', results[0].error
+    # the earlier group numbers are kept
+    with open(os.path.join(results[0].output,
+                           'again_classlist.csv')) as f:
+        numbers = set(line.rstrip().split(',')[-1] for line in f)
+    assert numbers == set(['Group Number', '7', '8', '9'])
@@ -0,0 +1,38 @@
+import os
+
+from GroupEng.cache import cache_filename, load_classlist_cached, read_cache
+from GroupEng.student import load_classlist
+
+
+def records(students):
+    return [(dict(s.data), s.passthrough) for s in students]
+
+
+def test_cache_matches_csv(tmpdir):
+    classlist = str(tmpdir.join('class.csv'))
+    with open(classlist, 'w') as f:
+        f.write('ID,Gender,GPA,Notes\n1,F,3.5,a\n2,M,2.9,b\n3,F,,a\n')
+
+    plain = load_classlist(classlist, 'ID', ['Gender', 'GPA'])
+    first = load_classlist_cached(classlist, 'ID', ['Gender', 'GPA'])
+    assert os.path.exists(cache_filename(classlist))
+    second = load_classlist_cached(classlist, 'ID', ['Gender', 'GPA'])
+    assert records(plain) == records(first) == records(second)
+
+    # editing the class list makes the cache stale
+    with open(classlist, 'a') as f:
+        f.write('4,M,3.1,c\n')
+    assert len(load_classlist_cached(classlist, 'ID')) == 4
+    assert len(read_cache(classlist, 'ID')) == 4
+
+
+def test_unreadable_cache_is_rebuilt(tmpdir):
+    classlist = str(tmpdir.join('class.csv'))
+    with open(classlist, 'w') as f:
+        f.write('ID,Gender\n1,F\n2,M\n')
+    # an interrupted write, and a cache cut off part way through
+    for contents in [b'', b'GroupEngCache2\n\x05']:
+        with open(cache_filename(classlist), 'wb') as f:
+            f.write(contents)
+        assert len(load_classlist_cached(classlist, 'ID')) == 2
+        assert len(read_cache(classlist, 'ID')) == 2
@@ -0,0 +1,34 @@
+import random
+
+from GroupEng.construct import make_constructive_groups
+from GroupEng.rule import Aggregate, Balance, Cluster, Distribute
+
+
+def test_count_rules_met_from_the_start(course_from_rows):
+    rng = random.Random(3)
+    rows = [{'ID': i, 'Major': 'CS' if i % 4 == 0 else 'EE',
+             'Gender': 'F' if i % 5 == 0 else 'M',
+             'GPA': round(rng.uniform(2, 4), 2)} for i in range(1, 41)]
+    course = course_from_rows(rows)
+    rules = [Distribute('Major', course, 'CS'), Cluster('Gender', course, 'F'),
+             Balance('GPA', course)]
+    groups = make_constructive_groups(course, rules, rng=rng)
+    assert sorted(len(g.students) for g in groups) == [4] * 10
+    assert all(rules[0].check(g) for g in groups)
+    assert all(rules[1].check(g) for g in groups)
+
+
+def test_aggregate_blocks(course_from_rows):
+    rows = [{'ID': i, 'Project': 'abc'[i % 3]} for i in range(1, 25)]
+    course = course_from_rows(rows)
+    rule = Aggregate('Project', course)
+    groups = make_constructive_groups(course, [rule], rng=random.Random(1))
+    assert all(rule.check(g) for g in groups)
+
+
+def test_one_phantom_per_group(course_from_rows):
+    rows = [{'ID': i, 'GPA': 3.0} for i in range(1, 19)]
+    course = course_from_rows(rows)
+    groups = make_constructive_groups(course, [Balance('GPA', course)],
+                                      rng=random.Random(2))
+    assert all(g.number_with('ID', 'phantom') <= 1 for g in groups)
@@ -0,0 +1,78 @@
+import io
+
+import GroupEng
+from GroupEng.controller import OutputMemory
+from GroupEng.feasibility import analyze
+from GroupEng.rule import Aggregate, Balance, Cluster, Distribute
+
+
+def test_lone_cluster_value(course_from_rows):
+    rows = [{'ID': i, 'Gender': 'F' if i == 1 else 'M'} for i in range(1, 10)]
+    course = course_from_rows(rows, '3+')
+    rule = Cluster('Gender', course, 'F')
+    problems = analyze([rule], course)
+    assert [p.rule for p in problems] == [rule]
+    assert not rule.feasible
+
+
+def test_distribute_conflicts_with_aggregate(course_from_rows):
+    # every group needs a CS major, but the project b groups have none
+    rows = ([{'ID': i, 'Project': 'a', 'Major': 'CS'} for i in range(1, 4)] +
+            [{'ID': i, 'Project': 'a', 'Major': 'EE'} for i in range(4, 7)] +
+            [{'ID': i, 'Project': 'b', 'Major': 'EE'} for i in range(7, 10)])
+    course = course_from_rows(rows, '3+')
+    aggregate = Aggregate('Project', course)
+    distribute = Distribute('Major', course, 'CS')
+    problems = analyze([aggregate, distribute], course)
+    assert [(p.rule, p.conflict) for p in problems] == [(distribute,
+                                                         aggregate)]
+    assert aggregate.feasible
+
+
+def test_feasible_rules_pass(course_from_rows):
+    rows = [{'ID': i, 'Gender': 'FM'[i % 2]} for i in range(1, 10)]
+    course = course_from_rows(rows, '3+')
+    rules = [Cluster('Gender', course, 'F'), Distribute('Gender', course)]
+    assert analyze(rules, course) == []
+    assert all(r.feasible for r in rules)
+
+
+def test_odd_cluster_in_pairs(course_from_rows):
+    # three F students can't all be in pairs
+    rows = [{'ID': i, 'Gender': 'F' if i <= 3 else 'M'} for i in range(1, 10)]
+    course = course_from_rows(rows, '2-')
+    rule = Cluster('Gender', course, 'F')
+    assert [p.rule for p in analyze([rule], course)] == [rule]
+    rows[3]['Gender'] = 'F'
+    course = course_from_rows(rows, '2-')
+    assert analyze([Cluster('Gender', course, 'F')], course) == []
+
+
+def test_balance_counts_phantoms(course_from_rows):
+    # 10 students in 3 groups of 4 takes two phantoms, which get a GPA when
+    # the groups are made, so two real GPAs are enough
+    rows = [{'ID': i, 'GPA': {1: 3.0, 2: 2.0}.get(i)} for i in range(1, 11)]
+    course = course_from_rows(rows, '4-')
+    assert course.n_groups == 3
+    assert analyze([Balance('GPA', course)], course) == []
+
+
+def test_balance_without_spread(course_from_rows):
+    rows = [{'ID': i, 'GPA': 3.0 if i == 1 else None} for i in range(1, 11)]
+    course = course_from_rows(rows, '4-')
+    rule = Balance('GPA', course)
+    assert [p.rule for p in analyze([rule], course)] == [rule]
+
+
+def test_sparse_balance_groups():
+    # groups with no GPA at all, or only one value to go round
+    for gpas in [{1: 3.0}, {1: 3.0, 2: 2.0}]:
+        rows = [{'ID': i, 'GPA': gpas.get(i)} for i in range(1, 11)]
+        dek = GroupEng.read_input(io.StringIO(
+            'group_size : 4-\nseed : 1\n- balance : GPA\n'))
+        grouping = GroupEng.make_groups(
+            dek, GroupEng.students_from_table(rows, 'ID'), parallel=False)
+        assert len(grouping.groups) == 3
+        out = OutputMemory('sparse')
+        grouping.write(out, 'sparse.groupeng', 'sparse.csv')
+        assert 'sparse_statistics.txt' in out.files
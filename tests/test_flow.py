@@ -0,0 +1,32 @@
+import random
+
+from GroupEng.flow import place
+from GroupEng.rule import Aggregate, Distribute
+
+
+def test_distribute_placed_exactly(course_from_rows, groups_in_order):
+    # every CS major starts out in the first groups
+    rows = [{'ID': i, 'Major': 'CS' if i <= 12 else 'EE' if i <= 30 else 'ME'}
+            for i in range(1, 41)]
+    course = course_from_rows(rows)
+    groups = groups_in_order(course)
+    rule = Distribute('Major', course)
+    place(rule, groups, random.Random(1))
+    assert all(rule.check(g) for g in groups)
+    assert sorted(len(g.students) for g in groups) == [4] * 10
+
+
+def test_higher_priority_rules_kept(course_from_rows, groups_in_order):
+    # groups are one project each, and CS majors are all on project a, so
+    # spreading them out would break the aggregate rule
+    rows = [{'ID': i, 'Project': 'a' if i <= 8 else 'b',
+             'Major': 'CS' if i <= 4 else 'EE'} for i in range(1, 17)]
+    course = course_from_rows(rows)
+    groups = groups_in_order(course)
+    aggregate = Aggregate('Project', course)
+    for g in groups:
+        g.add_rule(aggregate)
+    rule = Distribute('Major', course, 'CS')
+    place(rule, groups, random.Random(1))
+    assert all(aggregate.check(g) for g in groups)
+    assert sum(g.number_with('Major', 'CS') for g in groups[:2]) == 4
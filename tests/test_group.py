@@ -0,0 +1,137 @@
+import random
+
+import pytest
+
+from GroupEng.student import Student, students_from_table
+from GroupEng.course import Course, GroupSizer
+from GroupEng.group import Group, swap
+from GroupEng.utility import mean
+from GroupEng.rule import (Aggregate, Balance, Cluster, Distribute,
+                           find_swap_target)
+
+
+def make_course(genders):
+    headers = ['ID', 'Gender']
+    students = [Student({'ID': str(i+1), 'Gender': g}, headers, 'ID')
+                for i, g in enumerate(genders)]
+    return Course(students, GroupSizer(group_size='3+'))
+
+
+def test_cached_rule_follows_swaps():
+    course = make_course(['F', 'M', 'M', 'F', 'M', 'M'])
+    rule = Cluster('Gender', course, 'F')
+    g1 = Group(course.students[:3], 1)
+    g2 = Group(course.students[3:], 2)
+    for g in (g1, g2):
+        g.add_rule(rule)
+
+    assert not g1.happy
+    assert not g2.happy
+
+    swap(course.students[1], course.students[3])
+    assert g1.happy
+    assert g2.happy
+    assert g1.satisfies_rule(rule) == rule.check(g1)
+
+    g1.students = [s for s in g1.students if s['Gender'] != 'M']
+    assert g1.satisfies_rule(rule) == rule.check(g1)
+
+
+def test_counts_follow_swaps():
+    course = make_course(['F', 'M', 'M', 'F', 'F', 'M'])
+    g1 = Group(course.students[:3], 1)
+    g2 = Group(course.students[3:], 2)
+    assert g1.number_with('Gender', 'F') == 1
+    assert g2.number_with('Gender', ('F', 'M')) == 3
+
+    swap(course.students[0], course.students[5])
+    for g in (g1, g2):
+        assert g.number_with('Gender', 'F') == sum(
+            1 for s in g.students if s['Gender'] == 'F')
+    assert 'M' not in g2.counts('Gender')
+
+
+def test_running_mean_follows_swaps():
+    course = make_course(['F', 'M', 'M', 'F', 'F', 'M'])
+    for i, s in enumerate(course.students):
+        s.data['GPA'] = None if i == 2 else float(i)
+    g1 = Group(course.students[:3], 1)
+    g2 = Group(course.students[3:], 2)
+    assert g1.mean('GPA') == 0.5
+
+    swap(course.students[2], course.students[5])
+    assert g1.mean('GPA') == 2.0
+    assert g2.mean('GPA') == 3.5
+
+
+def test_permissable_swap_agrees_with_check(course_from_rows,
+                                            groups_in_order):
+    rng = random.Random(5)
+    rows = [{'ID': i, 'Gender': rng.choice('FM'),
+             'Project': rng.choice(['a', 'b', None]),
+             'GPA': rng.choice([None, 2.0, 2.5, 3.0, 3.5, 4.0])}
+            for i in range(1, 17)]
+    course = course_from_rows(rows)
+    groups = groups_in_order(course)
+    rules = [Cluster('Gender', course, 'F'), Distribute('Gender', course),
+             Aggregate('Project', course), Balance('GPA', course)]
+
+    def distance(rule, students):
+        known = [s for s in students if rule.get_strength(s) is not None]
+        if not known:
+            return None
+        return abs(mean(known, rule.get_strength) - rule.mean)
+
+    for group in groups:
+        for leaving in group.students:
+            for joining in course.students:
+                if joining.group is group:
+                    continue
+                new = [s for s in group.students if s is not leaving]
+                new.append(joining)
+                for rule in rules:
+                    if isinstance(rule, Balance):
+                        # balance allows any swap that moves the mean closer
+                        old_d = distance(rule, group.students)
+                        new_d = distance(rule, new)
+                        ok = (rule.check(new) or None in (old_d, new_d) or
+                              new_d < old_d)
+                    else:
+                        ok = rule.check(new) or not rule.check(group.students)
+                    assert (bool(rule.permissable_swap(group, leaving, joining))
+                            == bool(ok)), (rule, group, leaving, joining)
+
+
+def test_new_column_on_shared_schema():
+    students = students_from_table([{'ID': 1, 'Gender': 'F'},
+                                    {'ID': 2, 'Gender': 'M'}], 'ID')
+    copies = [s.copy() for s in students]
+    students[0].data['GPA'] = 3.5
+    students[1].data['GPA'] = 2.5
+    assert [s['GPA'] for s in students] == [3.5, 2.5]
+    assert students[0].schema is students[1].schema
+    assert 'GPA' not in students[0].headers
+    # the schema the copies share is left alone
+    assert 'GPA' not in copies[0].schema.index
+    with pytest.raises(KeyError):
+        copies[0]['GPA']
+
+
+def test_swap_search_leaves_index_alone():
+    course = make_course(['F', 'M', 'M', 'F', 'M', 'M'])
+    g1 = Group(course.students[:3], 1)
+    g2 = Group(course.students[3:], 2)
+    males = course.students_with('Gender', 'M')
+    before = list(males)
+    find_swap_target(course.students[0], [g2], candidates=males,
+                     rng=random.Random(1))
+    assert males == before
+
+
+def test_swap_search_takes_iterators():
+    course = make_course(['F', 'M', 'M', 'F', 'M', 'M'])
+    g1 = Group(course.students[:3], 1)
+    g2 = Group(course.students[3:], 2)
+    target = find_swap_target(course.students[0], iter([g2]),
+                              rng=random.Random(1))
+    assert target in g2.students
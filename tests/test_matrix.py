@@ -0,0 +1,73 @@
+import os
+import pytest
+
+from GroupEng import input_parser
+from GroupEng.student import load_classlist
+from GroupEng.course import Course, sizer_from_dek
+from GroupEng.rule import make_rule, Distribute
+from GroupEng.group import make_initial_groups
+from GroupEng.group import swap
+from GroupEng.controller import make_groups, solver_options
+from GroupEng import matrix
+
+needs_numpy = pytest.mark.skipif(not matrix.available,
+                                 reason='numpy is not installed')
+
+root = os.path.split(os.path.split(os.path.abspath(__file__))[0])[0]
+
+
+def test_matrix_engine_needs_numpy(monkeypatch):
+    monkeypatch.setattr(matrix, 'available', False)
+    with pytest.raises(matrix.NumpyNotAvailable):
+        solver_options({'matrix_engine': True})
+    with pytest.raises(matrix.NumpyNotAvailable):
+        matrix.StudentMatrix([])
+    # the plain engine does not care
+    assert not solver_options({})['matrix']
+
+
+@needs_numpy
+def test_matrix_matches_rule_check():
+    dek = input_parser.read_input(
+        os.path.join(root, 'sample_group_specification.groupeng'))
+    students = load_classlist(os.path.join(root, dek['classlist']),
+                              dek.get('student_identifier'))
+    course = Course(students, sizer_from_dek(dek))
+    rules = [make_rule(r, course) for r in dek['rules']]
+    groups = make_initial_groups(
+        course, [r for r in rules if r.name == 'Balance'])
+    rules = [Distribute('ID', course, 'phantom')] + rules
+
+    verdicts = matrix.check_groups(rules, groups)
+    for rule in rules:
+        assert list(verdicts[rule]) == [bool(rule.check(g)) for g in groups]
+
+
+@needs_numpy
+def test_matrix_engine_solves_the_same():
+    deck = os.path.join(root, 'sample_group_specification.groupeng')
+    dek = input_parser.read_input(deck)
+    dek['seed'] = 1
+    students = load_classlist(os.path.join(root, dek['classlist']),
+                              dek.get('student_identifier'))
+    plain = make_groups(dek, students, parallel=False)
+    dek['matrix_engine'] = True
+    fast = make_groups(dek, students, parallel=False)
+    assert ([[s['ID'] for s in g.students] for g in plain.groups] ==
+            [[s['ID'] for s in g.students] for g in fast.groups])
+
+
+@needs_numpy
+def test_assignment_follows_swaps(course_from_rows, groups_in_order):
+    course = course_from_rows([{'ID': i} for i in range(1, 13)])
+    groups = groups_in_order(course)
+    checker = matrix.StudentMatrix(course.students)
+    assert list(checker.assignment(groups)) == [i // 4 for i in range(12)]
+
+    swap(course.students[0], course.students[5])
+    swap(course.students[6], course.students[11])
+    groups[2].remove(course.students[8])
+    order = groups[::-1]
+    fresh = matrix.StudentMatrix(course.students).assignment(order)
+    assert list(checker.assignment(order)) == list(fresh)
+    assert fresh[5] == 2 and fresh[0] == 1 and fresh[8] == -1
@@ -0,0 +1,61 @@
+import csv
+import io
+import os
+import zipfile
+
+from GroupEng import controller, input_parser
+
+
+def write_class(tmpdir, deck):
+    with open(str(tmpdir.join('class.csv')), 'w') as f:
+        f.write('ID,Gender,GPA,Email\n')
+        for i in range(12):
+            f.write('{0},{1},{2},s{0}@example.edu\n'.format(
+                i + 1, 'FMM'[i % 3], 2 + (i % 5) / 2.))
+    path = str(tmpdir.join('course.groupeng'))
+    with open(path, 'w') as f:
+        f.write('classlist : class.csv\n' + deck)
+    return path
+
+
+def test_archive(tmpdir):
+    deck = write_class(tmpdir, 'group_size : 3+\nseed : 1\narchive : yes\n'
+                       '- balance : GPA\n')
+    suceeded, path = controller.run(deck)
+    assert path.endswith('.zip')
+    with zipfile.ZipFile(path) as archive:
+        names = archive.namelist()
+        folder = names[0].split('/')[0]
+        assert sorted(n.split('/', 1)[1] for n in names) == sorted(
+            'course_' + name for name in ['groups.csv', 'groups.txt',
+                                          'statistics.txt', 'classlist.csv',
+                                          'details.csv'])
+        with archive.open(folder + '/course_classlist.csv') as f:
+            rows = list(csv.reader(io.TextIOWrapper(f)))
+    assert rows[0][-1] == 'Group Number'
+    assert sorted(int(r[0]) for r in rows[1:]) == list(range(1, 13))
+
+
+def test_unused_columns_pass_through(tmpdir):
+    deck = write_class(tmpdir, 'group_size : 3+\nseed : 1\n- balance : GPA\n')
+    dek = input_parser.read_input(deck)
+    students = controller.read_students(dek, str(tmpdir.join('class.csv')))
+    # only the identifier and the columns rules use are converted
+    assert students[0].schema.loaded == ['ID', 'GPA']
+    assert students[0].schema.passthrough == ['Gender', 'Email']
+
+    suceeded, path = controller.run(deck)
+    with open(os.path.join(path, 'course_classlist.csv')) as f:
+        rows = list(csv.DictReader(f))
+    assert sorted((int(r['ID']), r['Gender'], r['Email']) for r in rows) == [
+        (i + 1, 'FMM'[i % 3], 's{0}@example.edu'.format(i + 1))
+        for i in range(12)]
+
+
+def test_run_returns_stats(tmpdir):
+    deck = write_class(tmpdir, 'group_size : 3+\nseed : 1\n- balance : GPA\n')
+    result = controller.run(deck, collect_stats=True)
+    suceeded, path = result
+    assert path == result.outdir
+    assert result.stats.counts
+    assert len(result.grouping.groups) == 4
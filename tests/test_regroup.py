@@ -0,0 +1,69 @@
+import io
+from collections import Counter
+
+import GroupEng
+from GroupEng.regroup import regroup
+
+deck = """group_size : 3+
+seed : 1
+- cluster : Gender
+  values : F
+"""
+
+
+def test_drop_and_add_moves_few():
+    genders = 'FMMFMMFMMFMMFMM'
+    rows = [{'ID': str(i + 1), 'Gender': g} for i, g in enumerate(genders)]
+    dek = GroupEng.read_input(io.StringIO(deck))
+    first = GroupEng.make_groups(dek, GroupEng.students_from_table(rows, 'ID'))
+    previous = dict((s['ID'], s.group.group_number) for s in first.students)
+
+    # two drop, one adds
+    rows = [r for r in rows if r['ID'] not in ('2', '3')]
+    rows.append({'ID': '16', 'Gender': 'M'})
+    second = regroup(dek, GroupEng.students_from_table(rows, 'ID'), previous)
+
+    now = dict((s['ID'], s.group.group_number) for s in second.students)
+    assert sorted(now) == sorted(int(r['ID']) for r in rows)
+    assert len(second.groups) == len(first.groups)
+    assert max(Counter(now.values()).values()) <= 3
+    assert second.moved == sum(1 for i in now
+                               if i in previous and now[i] != previous[i])
+    assert second.moved <= 2
+
+
+def test_no_previous_groups():
+    rows = [{'ID': str(i + 1), 'Gender': 'FMM'[i % 3]} for i in range(12)]
+    dek = GroupEng.read_input(io.StringIO(deck))
+    grouping = regroup(dek, GroupEng.students_from_table(rows, 'ID'), {})
+    assert len(grouping.groups) == 4
+    assert grouping.moved == 0
+
+
+def test_new_groups_numbered_after_the_last():
+    # twelve earlier groups of one, numbers 10 and up sort after 9
+    rows = [{'ID': str(i + 1), 'Gender': 'F'} for i in range(13)]
+    previous = dict((i + 1, i + 1) for i in range(12))
+    dek = GroupEng.read_input(io.StringIO('group_size : 1+\nseed : 1\n'))
+    grouping = regroup(dek, GroupEng.students_from_table(rows, 'ID'),
+                       previous)
+    assert [g.group_number for g in grouping.groups] == list(range(1, 14))
+    assert grouping.moved == 0
+
+
+def test_leading_aggregate_splits_class():
+    rows = [{'ID': str(i + 1), 'Section': 'AB'[i % 2], 'Gender': 'FMM'[i % 3]}
+            for i in range(24)]
+    dek = GroupEng.read_input(io.StringIO(
+        'group_size : 4+\nseed : 2\n- aggregate : Section\n- cluster : Gender\n'
+        '  values : F\n'))
+    first = GroupEng.make_groups(dek, GroupEng.students_from_table(rows, 'ID'))
+    previous = dict((s['ID'], s.group.group_number) for s in first.students)
+
+    rows = rows[2:] + [{'ID': '25', 'Section': 'A', 'Gender': 'F'},
+                       {'ID': '26', 'Section': 'B', 'Gender': 'M'}]
+    second = regroup(dek, GroupEng.students_from_table(rows, 'ID'), previous)
+    for g in second.groups:
+        assert len(set(s['Section'] for s in g.students)) == 1
+    numbers = [g.group_number for g in second.groups]
+    assert len(numbers) == len(set(numbers))
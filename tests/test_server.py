@@ -0,0 +1,48 @@
+import json
+import threading
+import urllib.request
+
+from GroupEng import server
+
+deck = """group_size : 3+
+seed : 1
+- balance : GPA
+"""
+
+classlist = 'ID,GPA\n' + ''.join('{0},{1}\n'.format(i + 1, 2 + (i % 5) / 2.)
+                                 for i in range(12))
+
+
+def test_group_job_files():
+    result = server.group_job(deck, classlist, files=True)
+    assert len(result['groups']) == 4
+    assert 'groups_classlist.csv' in result['files']
+
+
+def test_server_groups():
+    s = server.make_server(port=0, workers=1)
+    threading.Thread(target=s.serve_forever, daemon=True).start()
+    try:
+        req = urllib.request.Request(
+            'http://127.0.0.1:{0}/group'.format(s.server_address[1]),
+            json.dumps({'deck': deck, 'classlist': classlist}).encode())
+        result = json.loads(urllib.request.urlopen(req).read().decode())
+        assert sorted(i for g in result['groups'] for i in g['students']) == \
+            sorted(str(i + 1) for i in range(12))
+    finally:
+        s.shutdown()
+        s.server_close()
+        s.service.close()
+
+
+def test_group_job_regroups():
+    first = server.group_job(deck, classlist, files=True)
+    previous = first['files']['groups_classlist.csv']
+    # one student drops
+    result = server.group_job(deck, classlist.replace('12,', '99,'),
+                              previous=previous)
+    before = dict((i, g['number']) for g in first['groups']
+                  for i in g['students'])
+    after = dict((i, g['number']) for g in result['groups']
+                 for i in g['students'])
+    assert sum(1 for i in after if i in before and after[i] != before[i]) <= 1
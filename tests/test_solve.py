@@ -0,0 +1,66 @@
+import io
+import itertools
+import random
+from types import SimpleNamespace
+
+import GroupEng
+from GroupEng import controller, instrument
+from GroupEng import rule as rule_module
+from GroupEng.rule import Cluster, apply_rule
+
+
+def test_restarts_keep_best(monkeypatch):
+    # fewest failures wins, then the smallest spread
+    scores = iter([(2, 0.1), (1, 0.9), (1, 0.4), (3, 0.0)])
+
+    def solve(course, dek_rules, identifier, options, offset, seed):
+        return SimpleNamespace(score=next(scores), seed=seed)
+
+    monkeypatch.setattr(controller, 'solve', solve)
+    course = SimpleNamespace(n_groups=2)
+    best, = controller.solve_all([course], [], 'ID', {'seed': 1}, restarts=4,
+                                 parallel=False)
+    assert best.score == (1, 0.4)
+
+
+def test_parallel_subcourses_match_serial():
+    rows = [{'ID': i, 'Section': 'ABC'[i % 3], 'GPA': 2 + (i % 5) / 2.}
+            for i in range(1, 31)]
+    dek = GroupEng.read_input(io.StringIO(
+        'group_size : 3+\nseed : 4\n- aggregate : Section\n- balance : GPA\n'))
+    students = GroupEng.students_from_table(rows, 'ID')
+    groupings = [GroupEng.make_groups(dek, students, parallel=parallel)
+                 for parallel in (True, False)]
+    members = [[[s['ID'] for s in g.students] for g in grouping.groups]
+               for grouping in groupings]
+    assert members[0] == members[1]
+    numbers = [g.group_number for g in groupings[0].groups]
+    assert numbers == list(range(1, len(numbers) + 1))
+    for g in groupings[0].groups:
+        assert len(set(s['Section'] for s in g.students)) == 1
+
+
+def retries(limits, course_from_rows, groups_in_order):
+    # a lone F student can never be clustered, so every try fails
+    rows = [{'ID': i, 'Gender': 'F' if i == 1 else 'M'} for i in range(1, 10)]
+    course = course_from_rows(rows, '3+')
+    groups = groups_in_order(course, 3)
+    rule = Cluster('Gender', course, 'F')
+    with instrument.collect() as stats:
+        assert not apply_rule(rule, groups, course.students, tries=10,
+                              rng=random.Random(1), **limits)
+    return stats.counts[instrument.label(rule)]['retries']
+
+
+def test_patience_stops_early(course_from_rows, groups_in_order):
+    assert retries({}, course_from_rows, groups_in_order) == 10
+    assert retries({'patience': 2}, course_from_rows, groups_in_order) == 2
+
+
+def test_time_limit_stops_early(course_from_rows, groups_in_order,
+                                monkeypatch):
+    # every look at the clock is a second later
+    clock = itertools.count()
+    monkeypatch.setattr(rule_module.time, 'time', lambda: next(clock))
+    assert retries({'time_limit': 2.5}, course_from_rows,
+                   groups_in_order) == 2
@@ -0,0 +1,249 @@
+"""
+Benchmark GroupEng on synthetic classes.
+
+Generates class lists with a chosen number of students, categorical attributes
+(with adjustable skew in how common each value is) and numeric attributes,
+along with a matching input deck, then times each phase of a GroupEng run
+separately: loading the class list, making the initial groups, each rule
+application and each output writer.
+
+Results are appended as JSON lines (tagged with the current git commit) to a
+results file so runs from different commits can be compared:
+
+    python tools/benchmark.py --sizes 100,1000,10000 --record bench.jsonl
+    python tools/benchmark.py --compare bench.jsonl
+"""
+
+import argparse
+import csv
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+
+root = os.path.split(os.path.split(os.path.abspath(__file__))[0])[0]
+sys.path.insert(0, root)
+
+from GroupEng import input_parser
+from GroupEng.controller import (group_output, statistics, student_full_output,
+                                 student_augmented_output, group_sort_key,
+                                 sort_students, summarize, initial_groups,
+                                 solver_options)
+from GroupEng.course import Course, sizer_from_dek
+from GroupEng.rule import make_rule, apply_rule, Balance, Distribute
+from GroupEng.student import load_classlist
+
+def make_classlist(filename, n_students, n_categorical=3, n_numeric=1,
+                   n_values=4, skew=1.0, seed=None):
+    """
+    Write a synthetic class list
+
+    Categorical attribute i is named Cat<i> and takes values v1, v2, ... with
+    value k drawn with weight 1/k**skew (skew 0 makes all values equally
+    common).  Numeric attributes are named Num<i> and are roughly GPA like.
+    """
+    rng = random.Random(seed)
+    weights = [1 / (k + 1) ** skew for k in range(n_values)]
+    values = ['v{}'.format(k + 1) for k in range(n_values)]
+    headers = (['ID'] + ['Cat{}'.format(i) for i in range(n_categorical)] +
+               ['Num{}'.format(i) for i in range(n_numeric)])
+    with open(filename, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(headers)
+        for n in range(n_students):
+            row = [n + 1]
+            row += rng.choices(values, weights, k=n_categorical)
+            row += ['{:.3f}'.format(min(4.0, max(1.0, rng.gauss(3, .5))))
+                    for i in range(n_numeric)]
+            writer.writerow(row)
+    return headers
+
+def make_deck(filename, classlist, n_categorical=3, n_numeric=1,
+              group_size='4+', tries=5):
+    """
+    Write an input deck for a class list from make_classlist: cluster the
+    first categorical attribute, distribute the rest and balance the numeric
+    attributes.
+    """
+    lines = ['classlist : {}'.format(classlist),
+             'student_identifier : ID',
+             'group_size : {}'.format(group_size),
+             'tries : {}'.format(tries)]
+    for i in range(n_categorical):
+        if i == 0:
+            lines += ['- cluster : Cat0', '  values : v2']
+        else:
+            lines += ['- distribute : Cat{}'.format(i)]
+    for i in range(n_numeric):
+        lines += ['- balance : Num{}'.format(i)]
+    with open(filename, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+class Timer(object):
+    def __init__(self):
+        self.times = OrderedDict()
+
+    def time(self, name, f, *args, **kwargs):
+        start = time.perf_counter()
+        result = f(*args, **kwargs)
+        self.times[name] = time.perf_counter() - start
+        return result
+
+def time_run(deck, outdir, seed=None):
+    """
+    Run GroupEng on deck one phase at a time, seed makes the run repeatable
+
+    Returns
+    -------
+    times: OrderedDict
+        phase name -> seconds
+    """
+    timer = Timer()
+    rng = random.Random(seed)
+    dek = input_parser.read_input(deck)
+    students = timer.time('load_classlist', load_classlist, dek['classlist'],
+                          dek.get('student_identifier'))
+    identifier = students[0].identifier
+    course = Course(students, sizer_from_dek(dek))
+    rules = timer.time('make_rules', lambda: [make_rule(r, course)
+                                              for r in dek['rules']])
+    balance_rules = [r for r in rules if isinstance(r, Balance)]
+    initial = solver_options(dek)['initial']
+    groups = timer.time('initial groups ({})'.format(initial),
+                        initial_groups[initial], course, rules, balance_rules,
+                        0, rng)
+    rules = [Distribute(identifier, course, 'phantom')] + rules
+    for i, rule in enumerate(rules):
+        timer.time('apply_rule {} {} {}'.format(i, rule.name, rule.attribute),
+                   apply_rule, rule, groups, course.students,
+                   dek.get('tries', 5), rng=rng)
+
+    for group in groups:
+        group.students = [s for s in group.students
+                          if s.data[identifier] != 'phantom']
+    groups.sort(key=group_sort_key)
+    students = timer.time('sort students', sort_students, groups,
+                          course.students_no_phantoms)
+    summaries = timer.time('summarize groups', summarize, groups, rules,
+                           balance_rules, identifier)
+
+    def out(name):
+        return open(os.path.join(outdir, name), 'w')
+
+    with out('groups.csv') as f:
+        timer.time('write groups.csv', group_output, groups, f, identifier,
+                   summaries=summaries)
+    with out('groups.txt') as f:
+        timer.time('write groups.txt', group_output, groups, f, identifier,
+                   sep='\n', summaries=summaries)
+    with out('statistics.txt') as f:
+        timer.time('write statistics.txt', statistics, rules, groups,
+                   students, balance_rules, deck, dek['classlist'], f,
+                   summaries)
+    with out('classlist.csv') as f:
+        timer.time('write classlist.csv', student_full_output, students,
+                   identifier, f)
+    with out('details.csv') as f:
+        timer.time('write details.csv', student_augmented_output, students,
+                   rules, f, summaries, balance_rules)
+
+    failed = sum(1 for r in rules for g in groups if not g.satisfies_rule(r))
+    return timer.times, failed
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=root,
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def benchmark(sizes, n_categorical, n_numeric, n_values, skew, seed,
+              record=None):
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in sizes:
+            classlist = os.path.join(tmp, 'class_{}.csv'.format(n))
+            deck = os.path.join(tmp, 'class_{}.groupeng'.format(n))
+            make_classlist(classlist, n, n_categorical, n_numeric, n_values,
+                           skew, seed)
+            make_deck(deck, classlist, n_categorical, n_numeric)
+            outdir = os.path.join(tmp, 'out_{}'.format(n))
+            os.mkdir(outdir)
+            start = time.perf_counter()
+            times, failed = time_run(deck, outdir, seed)
+            total = time.perf_counter() - start
+
+            result = OrderedDict([
+                ('commit', git_commit()),
+                ('date', time.strftime('%Y-%m-%d %H:%M:%S')),
+                ('students', n),
+                ('categorical', n_categorical),
+                ('numeric', n_numeric),
+                ('values', n_values),
+                ('skew', skew),
+                ('seed', seed),
+                ('failed', failed),
+                ('total', total),
+                ('phases', times)])
+            results.append(result)
+
+            print('{} students: {:.3f}s total, {} rule failures'.format(
+                n, total, failed))
+            for phase, t in times.items():
+                print('    {:<40} {:9.4f}s'.format(phase, t))
+
+            if record is not None:
+                with open(record, 'a') as f:
+                    f.write(json.dumps(result) + '\n')
+    return results
+
+def compare(record):
+    """
+    Print total time by class size for each commit in a results file
+    """
+    rows = OrderedDict()
+    sizes = set()
+    with open(record) as f:
+        for line in f:
+            r = json.loads(line)
+            sizes.add(r['students'])
+            rows.setdefault(r['commit'], {})[r['students']] = r['total']
+    sizes = sorted(sizes)
+    print('{:<10}'.format('commit') +
+          ''.join('{:>12}'.format(n) for n in sizes))
+    for commit, totals in rows.items():
+        print('{:<10}'.format(str(commit)) +
+              ''.join('{:>12}'.format('{:.3f}'.format(totals[n])
+                                      if n in totals else '-')
+                      for n in sizes))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', default='100,1000',
+                        help='comma separated class sizes to run')
+    parser.add_argument('--categorical', type=int, default=3,
+                        help='number of categorical attributes')
+    parser.add_argument('--numeric', type=int, default=1,
+                        help='number of numeric attributes')
+    parser.add_argument('--values', type=int, default=4,
+                        help='number of values for each categorical attribute')
+    parser.add_argument('--skew', type=float, default=1.0,
+                        help='how much more common the first values are, '
+                        '0 for uniform')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--record', help='append results to this file')
+    parser.add_argument('--compare',
+                        help='summarize a results file instead of running')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(args.compare)
+    else:
+        benchmark([int(n) for n in args.sizes.split(',')], args.categorical,
+                  args.numeric, args.values, args.skew, args.seed,
+                  args.record)